@@ -1,17 +1,42 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, has_request_context, session
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, abort, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, has_request_context, Response, stream_with_context, Blueprint
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, EmailField, SubmitField
 from wtforms.validators import DataRequired, Length, Email, EqualTo
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from werkzeug.utils import secure_filename
 import json
-from collections import defaultdict
+from collections import Counter, defaultdict
 import calendar
 import random
+import tempfile
+import threading
+import uuid
+import hashlib
+import atexit
+import click
+from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from functools import wraps
+from instrumentation import Instrumentation
+from counters import CounterBuffer
+import ics
+from ratelimit import RateLimiter
+from passwords import PasswordHasher, calibrate
+from fragment_cache import TemplateCache
+from compression import Compress, precompress_directory
+from sessions import SqliteSessionInterface
+from replicas import ReadReplica, RoutingSQLAlchemy
+from group_commit import GroupCommitter
+from leaderboard import LeaderboardSet
+from outbox import Outbox
+from profiler import Profiler
+from recommendations import FeatureSpace, program_tokens, top_k, weighted_sum_rows, normalize_rows
+import numpy as np
+from importer import (ImportRowError, SUPPORTED_FORMATS, chunked, clean, detect_format, iter_records,
+                      parse_bool, parse_datetime, parse_float, parse_int)
 
 # Message definitions
 MESSAGES = {
@@ -23,7 +48,10 @@ MESSAGES = {
     'invalid_credentials': 'Қате пайдаланушы аты немесе құпия сөз',
     'logout_success': 'Жүйеден сәтті шықтыңыз',
     'program_created': 'Жаттығу бағдарламасы сәтті құрылды',
-    'file_not_allowed': 'Бұл файл түріне рұқсат етілмеген'
+    'file_not_allowed': 'Бұл файл түріне рұқсат етілмеген',
+    'goal_conflict': 'Мақсат басқа жерде өзгертілді, бетті жаңартып қайталаңыз',
+    'rate_limited': 'Сұраулар тым көп, біраз уақыттан кейін қайталаңыз',
+    'user_not_found': 'Пайдаланушы табылмады'
 }
 
 # Form Classes
@@ -54,16 +82,116 @@ app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///fitness.db'
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4', 'webm'}
+app.config['IMPORT_CHUNK_SIZE'] = 5000  # Rows per import transaction
+app.config['IMPORT_MAX_ERRORS'] = 50  # Row errors kept on an import job
+app.config['SLOW_QUERY_THRESHOLD_MS'] = 100  # Log SQL statements slower than this
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')  # Bearer token Prometheus sends to scrape /metrics
+app.config['METRICS_ALLOWED_IPS'] = ('127.0.0.1', '::1')  # Addresses that may scrape /metrics without the token
+app.config['PROFILER_ADMINS'] = ()  # Usernames allowed to profile requests with X-Profile or ?_profile=1
+app.config['PROFILER_SAMPLE_RATE'] = 0  # Profile 1 in N requests per endpoint; 0 turns sampling off
+app.config['PROFILER_INTERVAL_MS'] = 5  # Stack sampling interval
+app.config['GOAL_PROGRESS_BATCH_LIMIT'] = 100  # Deltas accepted per /api/goals/progress call
+app.config['SCHEDULER_ENABLED'] = os.environ.get('SCHEDULER_ENABLED', '1') != '0'  # Run the shared periodic jobs in web processes; turn off where `flask run-scheduler` runs them
+app.config['GOAL_SWEEP_INTERVAL_MINUTES'] = 5
+app.config['GOAL_SWEEP_BATCH_SIZE'] = 500  # Goals per sweeper transaction
+app.config['GOAL_SWEEP_MAX_BATCHES'] = 20  # Batches per sweep kind and run; the rest waits for the next run
+app.config['GOAL_DUE_SOON_HOURS'] = 48
+app.config['FEED_PAGE_SIZE'] = 20  # Default page size of the shared/saved program feeds
+app.config['FEED_MAX_PAGE_SIZE'] = 100
+app.config['FEED_TIMELINE_SIZE'] = 500  # Entries kept per activity timeline; older ones are trimmed
+app.config['FEED_FANOUT_MAX_FOLLOWERS'] = 1000  # Actors with more followers are read on demand instead of fanned out
+app.config['FEED_RETENTION_DAYS'] = 90  # Activity older than this leaves every feed
+app.config['PROGRAM_STATS_FLUSH_SECONDS'] = 30  # How often buffered program counters are written
+app.config['PROGRAM_STATS_RECONCILE_HOURS'] = 24  # How often counters are rebuilt from source tables
+app.config['RECOMMENDATION_TOP_K'] = 20  # Recommendations stored per program and per user
+app.config['RECOMMENDATION_MAX_FEATURES'] = 512  # Most frequent feature tokens kept in the vectors
+app.config['RECOMMENDATION_CHUNK_SIZE'] = 256  # Rows scored per matrix product
+app.config['RECOMMENDATION_REFRESH_HOURS'] = 24
+app.config['CALENDAR_MAX_DAYS'] = 366  # Longest date range served by /api/calendar
+app.config['SYNC_PAGE_SIZE'] = 500  # Default page size of the /api/v1 collections
+app.config['SYNC_MAX_PAGE_SIZE'] = 2000
+app.config['SYNC_OVERLAP_SECONDS'] = 60  # updated_since is moved back this far to catch rows committed late
+app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:260000'  # Tune with `flask calibrate-password-hash`
+app.config['PASSWORD_HASH_WORKERS'] = os.cpu_count() or 2  # Hashing threads per process
+app.config['PASSWORD_HASH_MAX_PENDING'] = 32  # Queued hashes before new logins get 503
+app.config['JINJA_BYTECODE_CACHE_DIR'] = None  # Compiled templates; None uses a private per-user directory, False disables
+app.config['FRAGMENT_CACHE_SIZE'] = 1024  # Rendered {% cache %} blocks kept per process
+app.config['FRAGMENT_CACHE_TIMEOUT'] = 300  # Default {% cache %} TTL in seconds
+app.config['COMPRESS_MIN_SIZE'] = 500  # Smaller bodies are sent uncompressed
+app.config['COMPRESS_LEVEL'] = 6
+app.config['ARCHIVE_HORIZON_DAYS'] = 730  # Workouts older than this move to completed_workout_archive
+app.config['ARCHIVE_BATCH_SIZE'] = 5000  # Workouts moved per archive transaction
+app.config['ARCHIVE_MAX_BATCHES'] = 50  # Batches per archive run; the rest waits for the next run
+app.config['READ_REPLICA_URI'] = None  # e.g. 'sqlite:///fitness-replica.db'; read-only routes query it
+app.config['READ_REPLICA_STICKY_SECONDS'] = 30  # Users read the primary this long after writing; keep above the refresh interval
+app.config['READ_REPLICA_REFRESH_SECONDS'] = 10  # How often a SQLite replica copy is rebuilt from the primary
+app.config['READ_REPLICA_MAX_LAG_SECONDS'] = 30  # Reads go to the primary while the replica copy is older than this
+app.config['GROUP_COMMIT_ENABLED'] = True  # Batch workout/goal/save writes on one writer thread; False commits inline
+app.config['GROUP_COMMIT_WINDOW_MS'] = 2  # How long the writer waits for more intents before committing
+app.config['GROUP_COMMIT_MAX_BATCH'] = 64  # Intents per shared transaction
+app.config['LEADERBOARD_SIZE'] = 100  # Longest top list served by /api/leaderboards
+app.config['LEADERBOARD_SYNC_SECONDS'] = 15  # How often the in-process boards pick up rows written by other workers
+app.config['LEADERBOARD_REBUILD_HOURS'] = 24  # How often the rank table is rebuilt from workout history
+app.config['OUTBOX_BATCH_SIZE'] = 200  # Events per dispatch transaction, shared by every handler
+app.config['OUTBOX_POLL_SECONDS'] = 1.0  # How often the dispatcher looks for events committed by other workers
+app.config['OUTBOX_RETENTION_HOURS'] = 24  # Delivered events are kept this long for inspection
+app.config['OUTBOX_MAX_ATTEMPTS'] = 5  # Failures before an event moves to the handler's dead letters
+app.config['OUTBOX_RETRY_SECONDS'] = 5  # First retry delay after a handler fails; doubles per attempt
+app.config['SESSION_STORAGE'] = 'sessions.db'  # Server-side session rows; the cookie holds only their id
+app.config['RATELIMIT_STORAGE'] = 'ratelimit.db'  # SQLite file shared by all workers on the host
+# Token buckets per route: scope -> 'N/period'; a full bucket allows a burst of N
+app.config['RATELIMIT_LIMITS'] = {
+    'login': {'ip': '20/minute', 'username': '5/minute'},
+    'register': {'ip': '5/hour'},
+    'share_program': {'user': '30/hour'},
+    'upload_image': {'ip': '60/hour', 'user': '20/hour'},
+    'import_history': {'user': '5/hour'}
+}
 
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
+instrumentation = Instrumentation(app)
+limiter = RateLimiter(app, identity=lambda: current_user.get_id())
+passwords = PasswordHasher(app)
+template_cache = TemplateCache(app)
+compress = Compress(app)
+sessions = SqliteSessionInterface(app)
+profiler = Profiler(app, is_admin=lambda: current_user.is_authenticated
+                    and current_user.username in app.config['PROFILER_ADMINS'])
+replica = ReadReplica(app, db)
+writer = GroupCommitter(app, db)
+instrumentation.gauge('fitness_password_hash_pending', 'Password hashes queued or running.',
+                      lambda: passwords.pending)
+instrumentation.gauge('fitness_group_commit_pending', 'Write intents waiting for the group commit writer.',
+                      lambda: writer.pending)
+scheduler = BackgroundScheduler(daemon=True)
+program_counters = CounterBuffer()
+
+# Programs shared with a user (user_id is the recipient)
+program_shares = db.Table('program_share',
+    db.Column('program_id', db.Integer, db.ForeignKey('workout_program.id'), primary_key=True),
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('shared_by_id', db.Integer, db.ForeignKey('user.id')),
+    db.Column('created_at', db.DateTime, nullable=False, default=datetime.utcnow),
+    db.Index('ix_program_share_user_created', 'user_id', 'created_at')
+)
 
-# Association table for shared programs
-program_shares = db.Table('program_shares',
+# Programs a user saved for later
+program_saves = db.Table('program_save',
     db.Column('program_id', db.Integer, db.ForeignKey('workout_program.id'), primary_key=True),
-    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('created_at', db.DateTime, nullable=False, default=datetime.utcnow),
+    db.Index('ix_program_save_user_created', 'user_id', 'created_at')
+)
+
+# Who follows whom; the followee index serves fan-out
+follows = db.Table('follow',
+    db.Column('follower_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('followee_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('created_at', db.DateTime, nullable=False, default=datetime.utcnow),
+    db.Index('ix_follow_followee', 'followee_id', 'follower_id')
 )
 
 # Add muscle group translations
@@ -90,6 +218,29 @@ EQUIPMENT_TRANSLATIONS = {
     'Dumbbells': 'Гантельдер'
 }
 
+WORKOUT_INTENSITIES = ('low', 'medium', 'high')
+
+PROGRAM_STATS_COUNTERS = ('completions', 'unique_users', 'saves', 'shares', 'rating_sum', 'rating_count')
+
+# Weight of each counter in ProgramStats.popularity; ratings above 3 stars raise the score
+POPULARITY_WEIGHTS = {
+    'completions': 1,
+    'unique_users': 3,
+    'saves': 2,
+    'shares': 2,
+    'rating_sum': 1,
+    'rating_count': -3
+}
+
+# Goal units whose progress is derived from logged workouts
+AUTO_PROGRESS_UNITS = ('minutes', 'sessions', 'days')
+RECURRING_FREQUENCIES = ('daily', 'weekly', 'monthly')
+# Leaderboard window -> goal frequency whose period it spans; 'all' never rolls over
+LEADERBOARD_WINDOWS = {'week': 'weekly', 'month': 'monthly', 'all': None}
+LEADERBOARD_METRICS = ('workouts', 'minutes', 'streak')
+LEADERBOARD_EPOCH = datetime(1970, 1, 1)
+leaderboards = LeaderboardSet(LEADERBOARD_WINDOWS, LEADERBOARD_METRICS)
+
 # Database Models
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -100,12 +251,18 @@ class User(UserMixin, db.Model):
     completed_workouts = db.relationship('CompletedWorkout', backref='user', lazy=True)
     achievements = db.relationship('Achievement', backref='user', lazy=True)
     goals = db.relationship('Goal', backref='user', lazy=True)
-    shared_programs = db.relationship('WorkoutProgram', secondary=program_shares, lazy='subquery',
-                                     backref=db.backref('shared_with', lazy=True))
-    saved_programs = db.relationship('WorkoutProgram', secondary=program_shares, lazy='subquery',
-                                     backref=db.backref('saved_with', lazy=True))
+    shared_programs = db.relationship('WorkoutProgram', secondary=program_shares, lazy='dynamic', viewonly=True,
+                                     primaryjoin=lambda: User.id == program_shares.c.user_id,
+                                     backref=db.backref('shared_with', lazy='dynamic', viewonly=True))
+    saved_programs = db.relationship('WorkoutProgram', secondary=program_saves, lazy='dynamic', viewonly=True,
+                                     backref=db.backref('saved_with', lazy='dynamic', viewonly=True))
 
 class WorkoutProgram(db.Model):
+    __table_args__ = (
+        db.Index('ix_workout_program_updated', 'updated_at'),
+        db.Index('ix_workout_program_user_updated', 'user_id', 'updated_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
@@ -124,6 +281,7 @@ class WorkoutProgram(db.Model):
     fitness_level = db.Column(db.String(20))  # Beginner, Intermediate, Advanced
     program_type = db.Column(db.String(50))  # Strength, Bodybuilding, Toning, etc.
     calories_burn = db.Column(db.Integer)  # Estimated calories burned per session
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class ExerciseVideo(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -132,22 +290,64 @@ class ExerciseVideo(db.Model):
     program_id = db.Column(db.Integer, db.ForeignKey('workout_program.id'), nullable=False)
 
 class CompletedWorkout(db.Model):
+    __table_args__ = (
+        db.Index('ix_completed_workout_user_date', 'user_id', 'date'),
+        db.Index('ix_completed_workout_user_updated', 'user_id', 'updated_at'),
+        db.Index('ix_completed_workout_date', 'date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     notes = db.Column(db.Text)
     rating = db.Column(db.Integer)  # 1-5 rating
+    duration = db.Column(db.Integer)  # Duration in minutes
+    intensity = db.Column(db.String(20))  # low, medium, high
+    calories_burn = db.Column(db.Integer)  # Estimated calories burned
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     program_id = db.Column(db.Integer, db.ForeignKey('workout_program.id'), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class CompletedWorkoutArchive(db.Model):
+    """Cold copy of CompletedWorkout rows older than ARCHIVE_HORIZON_DAYS."""
+    __table_args__ = (
+        db.Index('ix_completed_workout_archive_user_date', 'user_id', 'date'),
+        db.Index('ix_completed_workout_archive_program', 'program_id'),
+    )
+
+    archive_id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(db.Integer, nullable=False)  # Original CompletedWorkout id
+    date = db.Column(db.DateTime, nullable=False)
+    notes = db.Column(db.Text)
+    rating = db.Column(db.Integer)
+    duration = db.Column(db.Integer)
+    intensity = db.Column(db.String(20))
+    calories_burn = db.Column(db.Integer)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    program_id = db.Column(db.Integer, db.ForeignKey('workout_program.id'), nullable=False)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
 class Achievement(db.Model):
+    __table_args__ = (
+        db.Index('ix_achievement_user_updated', 'user_id', 'updated_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
     icon = db.Column(db.String(50))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     date_earned = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class Goal(db.Model):
+    __table_args__ = (
+        db.Index('ix_goal_user_completed', 'user_id', 'is_completed'),
+        db.Index('ix_goal_completed_overdue_target_date', 'is_completed', 'is_overdue', 'target_date'),
+        db.Index('ix_goal_frequency_period_start', 'frequency', 'period_start'),
+        db.Index('ix_goal_user_updated', 'user_id', 'updated_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
@@ -161,6 +361,177 @@ class Goal(db.Model):
     unit = db.Column(db.String(20))  # Unit of measurement (kg, km, etc.)
     frequency = db.Column(db.String(50))  # How often to work on the goal (daily, weekly, etc.)
     priority = db.Column(db.Integer, default=1)  # 1-5 priority level
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1)  # Bumped by every progress update
+    period_start = db.Column(db.DateTime)  # Start of the current daily/weekly/monthly window
+    is_overdue = db.Column(db.Boolean, nullable=False, default=False)
+    reminded_at = db.Column(db.DateTime)  # When the goal was flagged as due soon
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class SyncTombstone(db.Model):
+    """Deleted row reported to /api/v1 delta syncs; user_id is NULL when every client may see it."""
+    __table_args__ = (
+        db.Index('ix_sync_tombstone_entity_deleted', 'entity', 'deleted_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)  # programs, workouts, goals, achievements
+    entity_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class OutboxEvent(db.Model):
+    """A domain event committed with the change it describes, waiting for its handlers."""
+    # AUTOINCREMENT keeps ids from being reused after a purge, which would hide them behind the cursors
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    type = db.Column(db.String(50), nullable=False, index=True)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @property
+    def data(self):
+        return json.loads(self.payload)
+
+class OutboxCursor(db.Model):
+    handler = db.Column(db.String(100), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)  # Last event id delivered to the handler
+    attempts = db.Column(db.Integer, nullable=False, default=0)  # Failures of the event after position
+    retry_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class OutboxDeadLetter(db.Model):
+    """An event a handler kept failing on, set aside so the handler could move on."""
+    id = db.Column(db.Integer, primary_key=True)
+    handler = db.Column(db.String(100), nullable=False, index=True)
+    event_id = db.Column(db.Integer, nullable=False)
+    type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)  # When the event was published
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False)
+    failed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @property
+    def data(self):
+        return json.loads(self.payload)
+
+outbox = Outbox(app, db, OutboxEvent, OutboxCursor, OutboxDeadLetter)
+instrumentation.gauge('fitness_outbox_pending_events', 'Outbox events not yet delivered to a handler.',
+                      lambda: outbox.pending(), label='handler')
+instrumentation.gauge('fitness_outbox_lag_seconds', 'Age of the oldest event a handler has not processed.',
+                      lambda: outbox.lag(), label='handler')
+instrumentation.gauge('fitness_outbox_dead_letters', 'Events a handler gave up on after OUTBOX_MAX_ATTEMPTS.',
+                      lambda: outbox.dead_letters(), label='handler')
+
+class ProgramEnrollment(db.Model):
+    __table_args__ = (
+        db.Index('ix_program_enrollment_user_active', 'user_id', 'active'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    program_id = db.Column(db.Integer, db.ForeignKey('workout_program.id'), nullable=False)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    current_day = db.Column(db.Integer, nullable=False, default=1)
+    last_activity_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    active = db.Column(db.Boolean, nullable=False, default=True)
+
+class ActivityEvent(db.Model):
+    """Something a user did that their followers see in the activity feed."""
+    __table_args__ = (
+        db.Index('ix_activity_event_actor_fanout_created', 'actor_id', 'fanned_out', 'created_at'),
+        db.Index('ix_activity_event_created', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    actor_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # workout, achievement, share or goal
+    program_id = db.Column(db.Integer, db.ForeignKey('workout_program.id'))
+    detail = db.Column(db.String(100))  # Achievement or goal name
+    fanned_out = db.Column(db.Boolean, nullable=False, default=True)  # False: followers read it on demand
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class FeedEntry(db.Model):
+    """An event copied into one follower's timeline."""
+    __table_args__ = (
+        db.Index('ix_feed_entry_user_created', 'user_id', 'created_at', 'event_id'),
+    )
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    event_id = db.Column(db.Integer, db.ForeignKey('activity_event.id'), primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+class ProgramStats(db.Model):
+    program_id = db.Column(db.Integer, db.ForeignKey('workout_program.id'), primary_key=True)
+    completions = db.Column(db.Integer, nullable=False, default=0)
+    unique_users = db.Column(db.Integer, nullable=False, default=0)
+    saves = db.Column(db.Integer, nullable=False, default=0)
+    shares = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    popularity = db.Column(db.Integer, nullable=False, default=0, index=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    program = db.relationship('WorkoutProgram', backref=db.backref('stats', uselist=False, lazy=True,
+                                                                   cascade='all, delete-orphan'))
+
+    @property
+    def average_rating(self):
+        return round(self.rating_sum / self.rating_count, 1) if self.rating_count else None
+
+class LeaderboardEntry(db.Model):
+    """A user's totals in one leaderboard period, kept current as workouts are completed."""
+    __table_args__ = (
+        db.Index('ix_leaderboard_entry_updated', 'updated_at'),
+    )
+
+    window = db.Column(db.String(10), primary_key=True)
+    period_start = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    workouts = db.Column(db.Integer, nullable=False, default=0)
+    minutes = db.Column(db.Integer, nullable=False, default=0)
+    streak = db.Column(db.Integer, nullable=False, default=0)  # Current streak as of last_workout_on
+    last_workout_on = db.Column(db.Date)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class ProgramRecommendation(db.Model):
+    program_id = db.Column(db.Integer, db.ForeignKey('workout_program.id'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    similar_program_id = db.Column(db.Integer, db.ForeignKey('workout_program.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+class UserRecommendation(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    program_id = db.Column(db.Integer, db.ForeignKey('workout_program.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+class ImportJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(255))
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, done, failed
+    rows_read = db.Column(db.Integer, nullable=False, default=0)
+    rows_imported = db.Column(db.Integer, nullable=False, default=0)
+    rows_skipped = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Text)  # JSON list of the first row errors
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'rows_read': self.rows_read,
+            'rows_imported': self.rows_imported,
+            'rows_skipped': self.rows_skipped,
+            'errors': json.loads(self.errors) if self.errors else [],
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
 
 class Exercise(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -182,6 +553,7 @@ class Exercise(db.Model):
     image_filename = db.Column(db.String(255))
     is_public = db.Column(db.Boolean, default=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -202,6 +574,7 @@ def index():
     return render_template('index.html')
 
 @app.route('/register', methods=['GET', 'POST'])
+@limiter.limit('register')
 def register():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -223,7 +596,7 @@ def register():
         user = User(
             username=form.username.data,
             email=form.email.data,
-            password_hash=generate_password_hash(form.password.data)
+            password_hash=passwords.hash(form.password.data)
         )
         db.session.add(user)
         db.session.commit()
@@ -234,6 +607,7 @@ def register():
     return render_template('register.html', form=form)
 
 @app.route('/login', methods=['GET', 'POST'])
+@limiter.limit('login', username=lambda: request.form.get('username', '').lower() or None)
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -241,8 +615,13 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
-        if user and check_password_hash(user.password_hash, form.password.data):
+        if user and passwords.verify(user.password_hash, form.password.data):
+            if passwords.needs_rehash(user.password_hash):
+                # Upgrade hashes made with older parameters while the plain password is at hand
+                user.password_hash = passwords.hash(form.password.data)
+                db.session.commit()
             login_user(user, remember=form.remember.data)
+            sessions.regenerate()
             flash(MESSAGES['login_success'], 'success')
             return redirect(url_for('index'))
         flash(MESSAGES['invalid_credentials'], 'danger')
@@ -252,6 +631,7 @@ def login():
 @login_required
 def logout():
     logout_user()
+    sessions.regenerate()
     flash(MESSAGES['logout_success'], 'success')
     return redirect(url_for('index'))
 
@@ -299,6 +679,8 @@ def delete_program(program_id):
     if program.user_id != current_user.id:
         return jsonify({'success': False, 'message': 'Рұқсат етілмеген'}), 403
     
+    db.session.add(SyncTombstone(entity='programs', entity_id=program.id,
+                                 user_id=None if program.is_public else program.user_id))
     db.session.delete(program)
     db.session.commit()
     return jsonify({'success': True})
@@ -312,122 +694,254 @@ def complete_workout(program_id):
         return redirect(url_for('index'))
     
     notes = request.form.get('notes', '')
-    completed = CompletedWorkout(
-        user_id=current_user.id,
-        program_id=program_id,
-        notes=notes
-    )
-    db.session.add(completed)
-    db.session.commit()
+    duration = request.form.get('duration', type=int)
+    intensity = request.form.get('intensity')
+    writer.run(record_workout, current_user.id, program_id, {
+        'notes': notes,
+        'duration': duration if duration and duration > 0 else None,
+        'intensity': intensity if intensity in WORKOUT_INTENSITIES else None,
+        'calories_burn': request.form.get('calories_burn', type=int) or program.calories_burn
+    })
     return redirect(url_for('index'))
 
+def record_workout(user_id, program_id, values):
+    """Write intent of complete_workout; goals, stats, leaderboards and the feed follow from its event."""
+    completed = CompletedWorkout(user_id=user_id, program_id=program_id, **values)
+    db.session.add(completed)
+    db.session.flush()
+    outbox.publish('WorkoutCompleted', workout_id=completed.id, user_id=user_id, program_id=program_id)
+    return completed.id
+
+def event_workouts(events):
+    """The workouts named by a batch of WorkoutCompleted events, in the order they were logged."""
+    ids = [event.data['workout_id'] for event in events]
+    return CompletedWorkout.query.filter(CompletedWorkout.id.in_(ids)).order_by(CompletedWorkout.id).all()
+
+@outbox.handler('WorkoutCompleted')
+def update_goals_for_workouts(events):
+    """Advance workout-tracked goals and announce the ones the workouts completed."""
+    workouts = event_workouts(events)
+    open_goals = [goal_id for (goal_id,) in db.session.query(Goal.id).filter(
+        Goal.user_id.in_({workout.user_id for workout in workouts}), Goal.is_completed == False)]
+    for workout in workouts:
+        apply_workout_to_goals(workout)
+    completed = defaultdict(list)
+    if open_goals:
+        for user_id, goal_id in db.session.query(Goal.user_id, Goal.id).filter(
+                Goal.id.in_(open_goals), Goal.is_completed == True):
+            completed[user_id].append(goal_id)
+    for user_id, goal_ids in completed.items():
+        outbox.publish('GoalUpdated', user_id=user_id, goal_ids=goal_ids, completed=goal_ids)
+
+@outbox.handler('WorkoutCompleted')
+def update_program_stats_for_workouts(events):
+    """Count completions and first-time users per program in one upsert."""
+    history = workout_history()
+    deltas = defaultdict(Counter)
+    for event in events:
+        data = event.data
+        # Only earlier workouts count, so a late or repeated delivery gives the same answer
+        first_completion = not db.session.query(db.exists().where(db.and_(
+            history.c.user_id == data['user_id'],
+            history.c.program_id == data['program_id'],
+            history.c.id < data['workout_id']
+        ))).scalar()
+        deltas[data['program_id']].update(completions=1, unique_users=int(first_completion))
+    add_program_stats(deltas)
+
+@outbox.handler('WorkoutCompleted')
+def update_leaderboards_for_workouts(events):
+    for workout in event_workouts(events):
+        record_leaderboard_workout(workout)
+
+@outbox.handler('WorkoutCompleted')
+def award_achievements_for_workouts(events):
+    for user_id in sorted({event.data['user_id'] for event in events}):
+        award_achievements(user_id)
+
+@outbox.handler('WorkoutCompleted')
+def publish_workout_activity(events):
+    for event in events:
+        publish_activity(event.data['user_id'], 'workout', program_id=event.data['program_id'],
+                         created_at=event.created_at)
+
+WORKOUT_HISTORY_COLUMNS = ('id', 'date', 'notes', 'rating', 'duration', 'intensity', 'calories_burn',
+                           'user_id', 'program_id', 'updated_at')
+
+def archive_cutoff():
+    """Workouts dated before this may live in the archive table."""
+    return datetime.utcnow() - timedelta(days=app.config['ARCHIVE_HORIZON_DAYS'])
+
+def workout_history(since=None):
+    """Selectable of completed workouts for queries that read ``.c`` columns.
+
+    Returns the hot table alone when everything from ``since`` on is still
+    hot; otherwise a UNION ALL of the hot and archive tables, so full-history
+    readers see archived rows transparently.
+    """
+    if since is not None and since >= archive_cutoff():
+        return CompletedWorkout.__table__
+    hot = db.select(*[CompletedWorkout.__table__.c[name] for name in WORKOUT_HISTORY_COLUMNS])
+    cold = db.select(*[CompletedWorkoutArchive.__table__.c[name] for name in WORKOUT_HISTORY_COLUMNS])
+    return db.union_all(hot, cold).subquery('workout_history')
+
+def archive_workouts(horizon_days=None):
+    """Move workouts older than the horizon to the archive table in chunked transactions.
+
+    Buffered program counters are flushed and pending outbox events
+    delivered first, so every rollup and handler that reads the hot table
+    sees its workouts before they move. Returns the rows moved.
+    """
+    days = horizon_days if horizon_days is not None else app.config['ARCHIVE_HORIZON_DAYS']
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    batch_size = app.config['ARCHIVE_BATCH_SIZE']
+    flush_program_stats()
+    outbox.dispatch()
+
+    hot = CompletedWorkout.__table__
+    columns = [hot.c[name] for name in WORKOUT_HISTORY_COLUMNS]
+    moved = 0
+    for _ in range(app.config['ARCHIVE_MAX_BATCHES']):
+        ids = [workout_id for (workout_id,) in db.session.query(CompletedWorkout.id)
+               .filter(CompletedWorkout.date < cutoff)
+               .order_by(CompletedWorkout.date).limit(batch_size)]
+        if not ids:
+            break
+        db.session.execute(CompletedWorkoutArchive.__table__.insert().from_select(
+            list(WORKOUT_HISTORY_COLUMNS), db.select(*columns).where(hot.c.id.in_(ids))))
+        db.session.execute(hot.delete().where(hot.c.id.in_(ids)))
+        db.session.commit()
+        moved += len(ids)
+    return moved
+
 def calculate_streak(user_id):
     """Calculate current and best workout streaks."""
-    workouts = CompletedWorkout.query.filter_by(user_id=user_id).order_by(CompletedWorkout.date.desc()).all()
-    if not workouts:
+    history = workout_history()
+    dates = db.session.query(history.c.date).filter(history.c.user_id == user_id).order_by(history.c.date.desc()).all()
+    if not dates:
         return 0, 0
     
-    current_streak = 0
+    current_streak = None
     best_streak = 0
     temp_streak = 0
     today = datetime.now().date()
     last_date = None
     
-    for workout in workouts:
-        workout_date = workout.date.date()
-        if last_date is None:
-            if (today - workout_date).days <= 1:
-                temp_streak = 1
-        else:
-            if (last_date - workout_date).days == 1:
-                temp_streak += 1
-            else:
-                if temp_streak > best_streak:
-                    best_streak = temp_streak
-                temp_streak = 1
+    for (date,) in dates:
+        workout_date = date.date()
+        if workout_date == last_date:
+            continue
+        if last_date is not None and (last_date - workout_date).days != 1:
+            # The most recent run is the current streak if it reaches today or yesterday
+            if current_streak is None:
+                current_streak = temp_streak
+            best_streak = max(best_streak, temp_streak)
+            temp_streak = 0
+        temp_streak += 1
         last_date = workout_date
     
-    current_streak = temp_streak if last_date and (today - last_date).days <= 1 else 0
+    if current_streak is None:
+        current_streak = temp_streak
+    if (today - dates[0][0].date()).days > 1:
+        current_streak = 0
     best_streak = max(best_streak, temp_streak)
     
     return current_streak, best_streak
 
-def get_monthly_stats(user_id):
+def get_recent_workouts(user_id):
+    """Fetch (date, duration, calories) rows covering the current month and the last 7 days."""
+    now = datetime.now()
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    week_start = (now - timedelta(days=6)).replace(hour=0, minute=0, second=0, microsecond=0)
+    
+    return CompletedWorkout.query.filter(
+        CompletedWorkout.user_id == user_id,
+        CompletedWorkout.date >= min(month_start, week_start)
+    ).with_entities(CompletedWorkout.date, CompletedWorkout.duration, CompletedWorkout.calories_burn).all()
+
+def get_monthly_stats(user_id, rows=None):
     """Get workout statistics for the current month."""
     start_date = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
     end_date = (start_date.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(seconds=1)
+    if rows is None:
+        rows = get_recent_workouts(user_id)
     
-    workouts = CompletedWorkout.query.filter(
-        CompletedWorkout.user_id == user_id,
-        CompletedWorkout.date.between(start_date, end_date)
-    ).all()
-    
-    total_duration = sum(workout.duration for workout in workouts if workout.duration)
-    total_calories = sum(workout.calories_burn for workout in workouts if workout.calories_burn)
+    total_workouts = total_duration = total_calories = 0
+    for date, duration, calories in rows:
+        if start_date <= date <= end_date:
+            total_workouts += 1
+            total_duration += duration or 0
+            total_calories += calories or 0
     
     return {
         'total_duration': total_duration,
         'total_calories': total_calories,
-        'total_workouts': len(workouts)
+        'total_workouts': total_workouts
     }
 
-def get_weekly_activity(user_id):
+def get_weekly_activity(user_id, rows=None):
     """Get workout durations for the last 7 days."""
     end_date = datetime.now()
-    start_date = end_date - timedelta(days=6)
-    
-    workouts = CompletedWorkout.query.filter(
-        CompletedWorkout.user_id == user_id,
-        CompletedWorkout.date.between(start_date, end_date)
-    ).all()
+    start_date = (end_date - timedelta(days=6)).replace(hour=0, minute=0, second=0, microsecond=0)
+    if rows is None:
+        rows = get_recent_workouts(user_id)
     
     daily_duration = defaultdict(int)
-    for workout in workouts:
-        daily_duration[workout.date.strftime('%a')] += workout.duration if workout.duration else 0
+    for date, duration, _ in rows:
+        if start_date <= date <= end_date and duration:
+            daily_duration[date.strftime('%a')] += duration
     
     days = [(end_date - timedelta(days=i)).strftime('%a') for i in range(6, -1, -1)]
     return [daily_duration[day] for day in days]
 
 def get_workout_types_distribution(user_id):
     """Get distribution of workout types."""
-    workouts = CompletedWorkout.query.filter_by(user_id=user_id).all()
-    type_counts = defaultdict(int)
-    
-    for workout in workouts:
-        type_counts[workout.category] += 1
+    history = workout_history()
+    type_counts = db.session.query(
+        WorkoutProgram.category,
+        db.func.count(history.c.id)
+    ).join(history, history.c.program_id == WorkoutProgram.id).filter(
+        history.c.user_id == user_id
+    ).group_by(WorkoutProgram.category).all()
     
-    total = sum(type_counts.values())
+    total = sum(count for _, count in type_counts)
     if total == 0:
         return [], []
     
-    labels = list(type_counts.keys())
-    data = [round((count / total) * 100) for count in type_counts.values()]
+    labels = [category for category, _ in type_counts]
+    data = [round((count / total) * 100) for _, count in type_counts]
     
     return labels, data
 
 def get_most_used_exercises(user_id):
-    """Get statistics for most frequently used exercises."""
-    workouts = CompletedWorkout.query.filter_by(user_id=user_id).all()
+    """Get statistics for most frequently used exercises.
+
+    Progress is the spread between the best and worst rating logged for the
+    programs that contain the exercise.
+    """
+    history = workout_history()
+    rows = db.session.query(
+        WorkoutProgram.exercises,
+        db.func.count(history.c.id),
+        db.func.min(history.c.rating),
+        db.func.max(history.c.rating)
+    ).join(history, history.c.program_id == WorkoutProgram.id).filter(
+        history.c.user_id == user_id
+    ).group_by(WorkoutProgram.id).all()
     exercise_stats = defaultdict(lambda: {'sets': 0, 'max_weight': 0, 'name': '', 'progress': 0})
     
-    for workout in workouts:
-        for exercise in workout.exercises:
+    for exercises_json, sessions, min_rating, max_rating in rows:
+        for exercise in program_exercise_names(exercises_json):
             stats = exercise_stats[exercise]
             stats['name'] = exercise
-            stats['sets'] += 1
-            stats['max_weight'] = max(stats['max_weight'], workout.rating or 0)
+            stats['sets'] += sessions
+            stats['max_weight'] = max(stats['max_weight'], max_rating or 0)
             stats['image'] = f"{exercise.lower().replace(' ', '-')}.svg"
             
             # Calculate progress based on rating improvement
-            initial_rating = CompletedWorkout.query.filter_by(
-                user_id=user_id, 
-                program_id=workout.program_id,
-                rating=workout.rating
-            ).order_by(CompletedWorkout.date).first()
-            
-            if initial_rating and initial_rating.rating:
-                progress = ((workout.rating or 0) - initial_rating.rating) / 5 * 100
-                stats['progress'] = min(max(round(progress), 0), 100)
+            if min_rating and max_rating:
+                progress = (max_rating - min_rating) / 5 * 100
+                stats['progress'] = max(stats['progress'], min(max(round(progress), 0), 100))
     
     # Sort by total sets and get top 5
     sorted_exercises = sorted(
@@ -438,12 +952,36 @@ def get_most_used_exercises(user_id):
     
     return sorted_exercises
 
+def program_exercise_names(exercises_json):
+    """Return the distinct exercise names in a program's JSON exercise plan.
+
+    Days that are not lists and names that are not strings are skipped, since
+    the plan is free-form JSON written by program authors.
+    """
+    try:
+        exercises_data = json.loads(exercises_json) if exercises_json else {}
+    except json.JSONDecodeError:
+        return []
+    if not isinstance(exercises_data, dict):
+        return []
+    names = []
+    for day_exercises in exercises_data.values():
+        if not isinstance(day_exercises, list):
+            continue
+        for exercise in day_exercises:
+            name = exercise.get('name') if isinstance(exercise, dict) else exercise
+            if isinstance(name, str) and name and name not in names:
+                names.append(name)
+    return names
+
 @app.route('/stats')
 @login_required
+@replica.reads
 def stats():
     current_streak, best_streak = calculate_streak(current_user.id)
-    monthly_stats = get_monthly_stats(current_user.id)
-    weekly_activity = get_weekly_activity(current_user.id)
+    recent_workouts = get_recent_workouts(current_user.id)
+    monthly_stats = get_monthly_stats(current_user.id, recent_workouts)
+    weekly_activity = get_weekly_activity(current_user.id, recent_workouts)
     workout_types_labels, workout_types_data = get_workout_types_distribution(current_user.id)
     most_used_exercises = get_most_used_exercises(current_user.id)
     
@@ -461,6 +999,7 @@ def stats():
 
 @app.route('/upload_image/<int:program_id>', methods=['POST'])
 @login_required
+@limiter.limit('upload_image')
 def upload_image(program_id):
     program = WorkoutProgram.query.get_or_404(program_id)
     if program.user_id != current_user.id:
@@ -485,12 +1024,124 @@ def upload_image(program_id):
     
     return redirect(url_for('edit_program', program_id=program_id))
 
+def calendar_range(args):
+    """Parse ``month=YYYY-MM`` or ``start``/``end`` (inclusive YYYY-MM-DD) into [start, end) datetimes.
+
+    Defaults to the current month; raises ValueError on bad input or a range
+    longer than CALENDAR_MAX_DAYS.
+    """
+    if args.get('start') or args.get('end'):
+        start = datetime.strptime(args.get('start', ''), '%Y-%m-%d')
+        end = datetime.strptime(args.get('end', ''), '%Y-%m-%d') + timedelta(days=1)
+    else:
+        month = args.get('month')
+        start = datetime.strptime(month, '%Y-%m') if month else datetime.now().replace(
+            day=1, hour=0, minute=0, second=0, microsecond=0)
+        end = (start + timedelta(days=32)).replace(day=1)
+    if end <= start or (end - start).days > app.config['CALENDAR_MAX_DAYS']:
+        raise ValueError('invalid calendar range')
+    return start, end
+
+def calendar_workouts_query(user_id, start=None, end=None):
+    """Workouts with their program titles, in date order, as a range scan of (user_id, date)."""
+    history = workout_history(since=start)
+    query = db.session.query(
+        history.c.id, history.c.date, history.c.duration, history.c.intensity,
+        history.c.calories_burn, history.c.rating, history.c.notes,
+        history.c.program_id, WorkoutProgram.title
+    ).join(WorkoutProgram, history.c.program_id == WorkoutProgram.id) \
+        .filter(history.c.user_id == user_id)
+    if start is not None:
+        query = query.filter(history.c.date >= start)
+    if end is not None:
+        query = query.filter(history.c.date < end)
+    return query.order_by(history.c.date)
+
+def calendar_days(user_id, start, end):
+    """Group the workouts in [start, end) by day with per-day totals."""
+    days = {}
+    for row in calendar_workouts_query(user_id, start, end):
+        key = row.date.date().isoformat()
+        day = days.get(key)
+        if day is None:
+            day = days[key] = {'date': key, 'count': 0, 'total_duration': 0, 'total_calories': 0, 'workouts': []}
+        day['count'] += 1
+        day['total_duration'] += row.duration or 0
+        day['total_calories'] += row.calories_burn or 0
+        day['workouts'].append({
+            'id': row.id,
+            'time': row.date.strftime('%H:%M'),
+            'program_id': row.program_id,
+            'title': row.title,
+            'duration': row.duration,
+            'intensity': row.intensity,
+            'calories_burn': row.calories_burn,
+            'rating': row.rating
+        })
+    return list(days.values())
+
 @app.route('/calendar')
 @login_required
 def calendar():
-    workouts = CompletedWorkout.query.filter_by(user_id=current_user.id).all()
-    workout_dates = {workout.date.date().isoformat(): workout.program.title for workout in workouts}
-    return render_template('calendar.html', workout_dates=workout_dates)
+    try:
+        start, end = calendar_range(request.args)
+    except ValueError:
+        start, end = calendar_range({})
+    days = calendar_days(current_user.id, start, end)
+    workout_dates = {day['date']: ', '.join(w['title'] for w in day['workouts']) for day in days}
+    return render_template('calendar.html', workout_dates=workout_dates, days=days,
+                           month=start.strftime('%Y-%m'))
+
+@app.route('/api/calendar')
+@login_required
+def api_calendar():
+    try:
+        start, end = calendar_range(request.args)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Жарамсыз күн аралығы'}), 400
+    days = calendar_days(current_user.id, start, end)
+    return jsonify({
+        'success': True,
+        'start': start.date().isoformat(),
+        'end': (end - timedelta(days=1)).date().isoformat(),
+        'total_workouts': sum(day['count'] for day in days),
+        'total_duration': sum(day['total_duration'] for day in days),
+        'total_calories': sum(day['total_calories'] for day in days),
+        'days': days
+    })
+
+@app.route('/calendar.ics')
+@login_required
+def calendar_ics():
+    """Stream the workout history (or a start/end/month range) as an iCalendar feed."""
+    start = end = None
+    if request.args:
+        try:
+            start, end = calendar_range(request.args)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Жарамсыз күн аралығы'}), 400
+    query = calendar_workouts_query(current_user.id, start, end).yield_per(1000)
+
+    def events():
+        for row in query:
+            description = []
+            if row.intensity:
+                description.append(f'Қарқындылық: {row.intensity}')
+            if row.calories_burn:
+                description.append(f'Калория: {row.calories_burn}')
+            if row.notes:
+                description.append(row.notes)
+            yield {
+                'uid': f'workout-{row.id}@fitness-app',
+                'start': row.date,
+                'end': row.date + timedelta(minutes=row.duration or 60),
+                'summary': row.title,
+                'description': '\n'.join(description)
+            }
+
+    return Response(stream_with_context(ics.iter_calendar(events(), name='Жаттығулар')),
+                    mimetype='text/calendar',
+                    headers={'Content-Disposition': 'attachment; filename=workouts.ics'})
 
 @app.route('/achievements')
 def achievements():
@@ -508,11 +1159,13 @@ def achievements():
                          total_count=total_count,
                          unlocked_count=unlocked_count)
 
-def check_achievements(user):
-    """Check and award achievements for the user."""
+def award_achievements(user_id):
+    """Award any newly earned achievements in the current transaction and return their names."""
     # Get user statistics
-    completed_workouts = CompletedWorkout.query.filter_by(user_id=user.id).count()
-    current_streak, best_streak = calculate_streak(user.id)
+    history = workout_history()
+    completed_workouts = db.session.query(db.func.count()).select_from(history) \
+        .filter(history.c.user_id == user_id).scalar()
+    current_streak, best_streak = calculate_streak(user_id)
     
     # Achievement definitions
     achievements = [
@@ -555,38 +1208,40 @@ def check_achievements(user):
     ]
     
     # Check and award achievements
+    existing = {name for (name,) in db.session.query(Achievement.name).filter_by(user_id=user_id)}
+    earned = []
     for achievement_data in achievements:
-        # Check if user already has this achievement
-        existing_achievement = Achievement.query.filter_by(
-            user_id=user.id,
-            name=achievement_data['name']
-        ).first()
-        
         # If achievement condition is met and user doesn't have it yet
-        if achievement_data['condition'] and not existing_achievement:
+        if achievement_data['condition'] and achievement_data['name'] not in existing:
             new_achievement = Achievement(
                 name=achievement_data['name'],
                 description=achievement_data['description'],
                 icon=achievement_data['icon'],
-                user_id=user.id
+                user_id=user_id
             )
             db.session.add(new_achievement)
-            flash(f'Жаңа жетістік алдыңыз: {achievement_data["name"]}!', 'success')
-    
-    db.session.commit()
+            publish_activity(user_id, 'achievement', detail=achievement_data['name'])
+            earned.append(achievement_data['name'])
+    return earned
+
+def check_achievements(user):
+    """Check and award achievements for the user."""
+    earned = award_achievements(user.id)
+    if earned:
+        db.session.commit()
+    for name in earned:
+        flash(f'Жаңа жетістік алдыңыз: {name}!', 'success')
 
 @app.route('/start_program/<int:program_id>')
 @login_required
 def start_program(program_id):
     program = WorkoutProgram.query.get_or_404(program_id)
     
-    # Создаем запись о начале программы
-    start_date = datetime.utcnow()
-    session['program_start'] = {
-        'id': program_id,
-        'date': start_date.strftime('%Y-%m-%d'),
-        'day': 1
-    }
+    # Создаем запись о начале программы; only one program is followed at a time
+    ProgramEnrollment.query.filter_by(user_id=current_user.id, active=True) \
+        .update({'active': False}, synchronize_session=False)
+    db.session.add(ProgramEnrollment(user_id=current_user.id, program_id=program.id))
+    db.session.commit()
     
     flash('Бағдарлама сәтті басталды! Бірінші күнді бастауға дайынсыз ба?', 'success')
     return redirect(url_for('view_workout_day', program_id=program_id, day=1))
@@ -601,6 +1256,10 @@ def view_workout_day(program_id, day):
         day_key = f"Күн {day}"
         day_exercises = exercises_data.get(day_key, [])
         
+        ProgramEnrollment.query.filter_by(user_id=current_user.id, program_id=program_id, active=True) \
+            .update({'current_day': day, 'last_activity_at': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        
         return render_template('workout_day.html',
                              program=program,
                              day=day,
@@ -610,18 +1269,33 @@ def view_workout_day(program_id, day):
         flash('Жаттығу күні табылмады', 'error')
         return redirect(url_for('view_program', program_id=program_id))
 
+@app.route('/continue_program')
+@login_required
+def continue_program():
+    """Resume the active program at the last opened day."""
+    enrollment = ProgramEnrollment.query.filter_by(user_id=current_user.id, active=True) \
+        .order_by(ProgramEnrollment.last_activity_at.desc()).first()
+    if enrollment is None:
+        flash('Белсенді бағдарлама жоқ', 'info')
+        return redirect(url_for('programs'))
+    return redirect(url_for('view_workout_day', program_id=enrollment.program_id, day=enrollment.current_day))
+
 @app.route('/save_for_later/<int:program_id>')
 @login_required
 def save_for_later(program_id):
     program = WorkoutProgram.query.get_or_404(program_id)
-    if program not in current_user.saved_programs:
-        current_user.saved_programs.append(program)
-        db.session.commit()
+    if writer.run(save_program, current_user.id, program.id):
+        count_program_event(program.id, saves=1)
         flash('Бағдарлама сақталды!', 'success')
     return redirect(url_for('view_program', program_id=program_id))
 
+def save_program(user_id, program_id):
+    """Write intent of save_for_later; returns False if the program was already saved."""
+    return add_program_link(program_saves, user_id, program_id)
+
 @app.route('/share_program/<int:program_id>', methods=['POST'])
 @login_required
+@limiter.limit('share_program')
 def share_program(program_id):
     program = WorkoutProgram.query.get_or_404(program_id)
     username = request.form.get('username')
@@ -635,26 +1309,840 @@ def share_program(program_id):
         flash('Пайдаланушы табылмады', 'danger')
         return redirect(url_for('view_program', program_id=program_id))
     
-    if program in user.shared_programs:
+    if not add_program_link(program_shares, user.id, program.id, shared_by_id=current_user.id):
         flash('Бағдарлама бұл пайдаланушымен бұрыннан бөлісілген', 'warning')
         return redirect(url_for('view_program', program_id=program_id))
     
-    user.shared_programs.append(program)
+    outbox.publish('ProgramShared', program_id=program.id, user_id=current_user.id, recipient_id=user.id)
     db.session.commit()
     flash(f'Бағдарлама {username} пайдаланушысымен бөлісілді', 'success')
     return redirect(url_for('view_program', program_id=program_id))
 
+@outbox.handler('ProgramShared')
+def update_program_stats_for_shares(events):
+    deltas = defaultdict(Counter)
+    for event in events:
+        deltas[event.data['program_id']].update(shares=1)
+    add_program_stats(deltas)
+
+@outbox.handler('ProgramShared')
+def publish_share_activity(events):
+    for event in events:
+        publish_activity(event.data['user_id'], 'share', program_id=event.data['program_id'],
+                         created_at=event.created_at)
+
+def add_program_link(table, user_id, program_id, **values):
+    """Insert a share/save row in the current transaction; returns False if it already existed."""
+    result = db.session.execute(sqlite_insert(table).values(
+        user_id=user_id, program_id=program_id, created_at=datetime.utcnow(), **values
+    ).on_conflict_do_nothing())
+    return result.rowcount == 1
+
+def program_feed(table):
+    """Return one keyset page of the current user's shared or saved programs, newest first.
+
+    The ``before`` cursor is the ``created_at|program_id`` of the last item of the
+    previous page, so every page is a single range scan of the (user_id, created_at) index.
+    """
+    limit = request.args.get('limit', app.config['FEED_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['FEED_MAX_PAGE_SIZE']))
+
+    columns = [table.c.created_at, WorkoutProgram.id, WorkoutProgram.title, WorkoutProgram.category,
+               WorkoutProgram.difficulty, WorkoutProgram.duration, WorkoutProgram.image_filename]
+    if 'shared_by_id' in table.c:
+        columns.append(User.username)
+    query = db.session.query(*columns) \
+        .select_from(table) \
+        .join(WorkoutProgram, WorkoutProgram.id == table.c.program_id) \
+        .filter(table.c.user_id == current_user.id)
+    if 'shared_by_id' in table.c:
+        query = query.outerjoin(User, User.id == table.c.shared_by_id)
+
+    cursor = request.args.get('before')
+    if cursor:
+        try:
+            created_text, program_text = cursor.rsplit('|', 1)
+            created_at, cursor_id = datetime.fromisoformat(created_text), int(program_text)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Жарамсыз курсор'}), 400
+        query = query.filter(db.or_(
+            table.c.created_at < created_at,
+            db.and_(table.c.created_at == created_at, table.c.program_id < cursor_id)
+        ))
+
+    rows = query.order_by(table.c.created_at.desc(), table.c.program_id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = []
+    for row in rows:
+        item = {
+            'program_id': row.id,
+            'title': row.title,
+            'category': row.category,
+            'difficulty': row.difficulty,
+            'duration': row.duration,
+            'image_filename': row.image_filename,
+            'created_at': row.created_at.isoformat()
+        }
+        if 'shared_by_id' in table.c:
+            item['shared_by'] = row.username
+        items.append(item)
+
+    next_cursor = None
+    if has_more:
+        next_cursor = f'{rows[-1].created_at.isoformat()}|{rows[-1].id}'
+    return jsonify({'success': True, 'items': items, 'next_cursor': next_cursor})
+
+@app.route('/api/programs/shared')
+@login_required
+def api_shared_programs():
+    return program_feed(program_shares)
+
+@app.route('/api/programs/saved')
+@login_required
+def api_saved_programs():
+    return program_feed(program_saves)
+
+def followers_at_least(user_id, count):
+    """Whether ``user_id`` has ``count`` or more followers, counting no further than that."""
+    followers = db.select(follows.c.follower_id).where(follows.c.followee_id == user_id).limit(count).subquery()
+    return db.session.query(db.func.count()).select_from(followers).scalar() >= count
+
+def publish_activity(actor_id, kind, program_id=None, detail=None, created_at=None):
+    """Record an activity event and fan it out to the actor's followers' timelines.
+
+    Actors with FEED_FANOUT_MAX_FOLLOWERS or more followers are not fanned
+    out; feed reads pull their events instead, so one action never writes
+    an unbounded number of timeline rows.
+    """
+    now = created_at or datetime.utcnow()
+    fan_out = not followers_at_least(actor_id, app.config['FEED_FANOUT_MAX_FOLLOWERS'])
+    event = ActivityEvent(actor_id=actor_id, kind=kind, program_id=program_id, detail=detail,
+                          fanned_out=fan_out, created_at=now)
+    db.session.add(event)
+    db.session.flush()
+    if fan_out:
+        db.session.execute(FeedEntry.__table__.insert().from_select(
+            ['user_id', 'event_id', 'created_at'],
+            db.select(follows.c.follower_id, db.literal(event.id), db.literal(now, db.DateTime))
+            .where(follows.c.followee_id == actor_id)
+        ))
+    return event
+
+def trim_feeds():
+    """Cap every timeline at FEED_TIMELINE_SIZE entries and drop activity past FEED_RETENTION_DAYS.
+
+    Returns the number of timeline entries removed.
+    """
+    size = app.config['FEED_TIMELINE_SIZE']
+    cutoff = datetime.utcnow() - timedelta(days=app.config['FEED_RETENTION_DAYS'])
+    trimmed = FeedEntry.query.filter(FeedEntry.created_at < cutoff).delete(synchronize_session=False)
+    ActivityEvent.query.filter(ActivityEvent.created_at < cutoff).delete(synchronize_session=False)
+
+    over = db.session.query(FeedEntry.user_id).group_by(FeedEntry.user_id).having(db.func.count() > size).all()
+    for (user_id,) in over:
+        # Newest entry past the cap; it and everything older goes
+        boundary = db.session.query(FeedEntry.created_at, FeedEntry.event_id).filter_by(user_id=user_id) \
+            .order_by(FeedEntry.created_at.desc(), FeedEntry.event_id.desc()).offset(size).first()
+        trimmed += FeedEntry.query.filter(FeedEntry.user_id == user_id, db.or_(
+            FeedEntry.created_at < boundary.created_at,
+            db.and_(FeedEntry.created_at == boundary.created_at, FeedEntry.event_id <= boundary.event_id)
+        )).delete(synchronize_session=False)
+    db.session.commit()
+    return trimmed
+
+@app.route('/follow/<username>', methods=['POST'])
+@login_required
+def follow(username):
+    user = User.query.filter_by(username=username).first()
+    if user is None or user.id == current_user.id:
+        if is_xhr():
+            return jsonify({'success': False, 'message': MESSAGES['user_not_found']}), 404
+        flash(MESSAGES['user_not_found'], 'danger')
+        return redirect(url_for('index'))
+
+    result = db.session.execute(sqlite_insert(follows).values(
+        follower_id=current_user.id, followee_id=user.id, created_at=datetime.utcnow()
+    ).on_conflict_do_nothing())
+    if result.rowcount:
+        # Seed the new timeline rows with the followee's recent fanned-out activity
+        recent = db.select(db.literal(current_user.id), ActivityEvent.id, ActivityEvent.created_at) \
+            .where(ActivityEvent.actor_id == user.id, ActivityEvent.fanned_out == True) \
+            .order_by(ActivityEvent.created_at.desc()).limit(app.config['FEED_TIMELINE_SIZE'])
+        db.session.execute(FeedEntry.__table__.insert().prefix_with('OR IGNORE').from_select(
+            ['user_id', 'event_id', 'created_at'], recent))
+    db.session.commit()
+
+    message = f'{user.username} пайдаланушысына жазылдыңыз'
+    if is_xhr():
+        return jsonify({'success': True, 'message': message})
+    flash(message, 'success')
+    return redirect(request.referrer or url_for('index'))
+
+@app.route('/unfollow/<username>', methods=['POST'])
+@login_required
+def unfollow(username):
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        if is_xhr():
+            return jsonify({'success': False, 'message': MESSAGES['user_not_found']}), 404
+        flash(MESSAGES['user_not_found'], 'danger')
+        return redirect(url_for('index'))
+
+    db.session.execute(follows.delete().where(follows.c.follower_id == current_user.id,
+                                              follows.c.followee_id == user.id))
+    FeedEntry.query.filter(
+        FeedEntry.user_id == current_user.id,
+        FeedEntry.event_id.in_(db.select(ActivityEvent.id).where(ActivityEvent.actor_id == user.id))
+    ).delete(synchronize_session=False)
+    db.session.commit()
+
+    message = f'{user.username} пайдаланушысынан жазылым тоқтатылды'
+    if is_xhr():
+        return jsonify({'success': True, 'message': message})
+    flash(message, 'success')
+    return redirect(request.referrer or url_for('index'))
+
+@app.route('/api/feed')
+@login_required
+def api_feed():
+    """One keyset page of activity from the people the current user follows, newest first.
+
+    The timeline is a range scan of (user_id, created_at); events of widely
+    followed actors, which are not fanned out, are merged into the same
+    statement from the (actor_id, fanned_out, created_at) index.
+    """
+    limit = request.args.get('limit', app.config['FEED_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['FEED_MAX_PAGE_SIZE']))
+
+    timeline = db.select(FeedEntry.event_id.label('event_id'), FeedEntry.created_at.label('created_at')) \
+        .where(FeedEntry.user_id == current_user.id)
+    followees = db.select(follows.c.followee_id).where(follows.c.follower_id == current_user.id)
+    pulled = db.select(ActivityEvent.id.label('event_id'), ActivityEvent.created_at.label('created_at')) \
+        .where(ActivityEvent.actor_id.in_(followees), ActivityEvent.fanned_out == False)
+
+    cursor = request.args.get('before')
+    if cursor:
+        try:
+            created_text, event_text = cursor.rsplit('|', 1)
+            created_at, cursor_id = datetime.fromisoformat(created_text), int(event_text)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Жарамсыз курсор'}), 400
+        timeline = timeline.where(db.or_(
+            FeedEntry.created_at < created_at,
+            db.and_(FeedEntry.created_at == created_at, FeedEntry.event_id < cursor_id)
+        ))
+        pulled = pulled.where(db.or_(
+            ActivityEvent.created_at < created_at,
+            db.and_(ActivityEvent.created_at == created_at, ActivityEvent.id < cursor_id)
+        ))
+
+    page = db.union_all(timeline, pulled).subquery('feed')
+    rows = db.session.query(page.c.event_id, page.c.created_at, ActivityEvent.kind, ActivityEvent.detail,
+                            ActivityEvent.program_id, User.username, WorkoutProgram.title, WorkoutProgram.is_public) \
+        .select_from(page) \
+        .join(ActivityEvent, ActivityEvent.id == page.c.event_id) \
+        .join(User, User.id == ActivityEvent.actor_id) \
+        .outerjoin(WorkoutProgram, WorkoutProgram.id == ActivityEvent.program_id) \
+        .order_by(page.c.created_at.desc(), page.c.event_id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = [{
+        'id': row.event_id,
+        'kind': row.kind,
+        'actor': row.username,
+        'program_id': row.program_id if row.is_public else None,
+        'title': row.title if row.is_public else None,
+        'detail': row.detail,
+        'created_at': row.created_at.isoformat()
+    } for row in rows]
+    next_cursor = None
+    if has_more:
+        next_cursor = f'{rows[-1].created_at.isoformat()}|{rows[-1].event_id}'
+    return jsonify({'success': True, 'items': items, 'next_cursor': next_cursor})
+
+def popularity_score(value):
+    """Weighted popularity; ``value(name)`` returns a counter as a number or SQL expression."""
+    return sum(weight * value(name) for name, weight in POPULARITY_WEIGHTS.items())
+
+def count_program_event(program_id, **deltas):
+    """Buffer program counter deltas; written through at once when no scheduler flushes them."""
+    program_counters.add(program_id, **deltas)
+    if not scheduler.running:
+        flush_program_stats()
+
+def upsert_program_stats(rows, accumulate):
+    """Insert or update ProgramStats rows, adding to or replacing the stored counters."""
+    table = ProgramStats.__table__
+    insert = sqlite_insert(table)
+    if accumulate:
+        new_value = lambda name: table.c[name] + insert.excluded[name]
+    else:
+        new_value = lambda name: insert.excluded[name]
+    values = {name: new_value(name) for name in PROGRAM_STATS_COUNTERS}
+    values['popularity'] = popularity_score(new_value)
+    values['updated_at'] = insert.excluded.updated_at
+    for chunk in chunked(rows, 500):
+        db.session.execute(insert.on_conflict_do_update(index_elements=[table.c.program_id], set_=values), chunk)
+
+def add_program_stats(deltas):
+    """Add per-program counter deltas with one batched upsert in the current transaction."""
+    now = datetime.utcnow()
+    rows = []
+    for program_id, counts in deltas.items():
+        counts = {name: counts.get(name, 0) for name in PROGRAM_STATS_COUNTERS}
+        rows.append({'program_id': program_id, 'popularity': popularity_score(counts.get), 'updated_at': now, **counts})
+    upsert_program_stats(rows, accumulate=True)
+    return len(rows)
+
+def flush_program_stats():
+    """Write the buffered counter deltas with one batched upsert."""
+    pending = program_counters.drain()
+    if not pending:
+        return 0
+    try:
+        add_program_stats(pending)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        program_counters.restore(pending)
+        raise
+    return len(pending)
+
+def reconcile_program_stats(program_ids=None):
+    """Rebuild program counters from the workout, share and save tables.
+
+    Buffered deltas are flushed and pending outbox events delivered first so
+    they are not counted twice. Deltas buffered or published by other
+    processes meanwhile may still drift until the next run.
+    """
+    flush_program_stats()
+    outbox.dispatch()
+    totals = defaultdict(lambda: dict.fromkeys(PROGRAM_STATS_COUNTERS, 0))
+
+    def restrict(query, column):
+        return query.filter(column.in_(program_ids)) if program_ids is not None else query
+
+    history = workout_history()
+    workouts = restrict(db.session.query(
+        history.c.program_id,
+        db.func.count(history.c.id),
+        db.func.count(db.distinct(history.c.user_id)),
+        db.func.coalesce(db.func.sum(history.c.rating), 0),
+        db.func.count(history.c.rating)
+    ), history.c.program_id).group_by(history.c.program_id)
+    for program_id, completions, unique_users, rating_sum, rating_count in workouts:
+        totals[program_id].update(completions=completions, unique_users=unique_users,
+                                  rating_sum=rating_sum, rating_count=rating_count)
+
+    for name, table in (('saves', program_saves), ('shares', program_shares)):
+        links = restrict(db.session.query(table.c.program_id, db.func.count()), table.c.program_id) \
+            .group_by(table.c.program_id)
+        for program_id, count in links:
+            totals[program_id][name] = count
+
+    # Programs whose source rows are gone are reset to zero
+    stale = restrict(db.session.query(ProgramStats.program_id), ProgramStats.program_id)
+    for (program_id,) in stale:
+        totals.setdefault(program_id, dict.fromkeys(PROGRAM_STATS_COUNTERS, 0))
+
+    now = datetime.utcnow()
+    rows = [{'program_id': program_id, 'popularity': popularity_score(counts.get), 'updated_at': now, **counts}
+            for program_id, counts in totals.items()]
+    upsert_program_stats(rows, accumulate=False)
+    db.session.commit()
+    return len(rows)
+
+def build_recommendations():
+    """Precompute the top-K similar public programs per program and per user.
+
+    Programs become TF-IDF vectors of their type, difficulty, level, muscle
+    groups, equipment and exercises; a user vector is the completion-weighted
+    sum of the programs they finished. Both tables are replaced in one
+    transaction so readers never see a half-built set.
+    """
+    k = app.config['RECOMMENDATION_TOP_K']
+    chunk_size = app.config['RECOMMENDATION_CHUNK_SIZE']
+
+    programs = db.session.query(
+        WorkoutProgram.id, WorkoutProgram.is_public, WorkoutProgram.program_type, WorkoutProgram.difficulty,
+        WorkoutProgram.fitness_level, WorkoutProgram.target_muscle_groups, WorkoutProgram.equipment_needed,
+        WorkoutProgram.exercises
+    ).order_by(WorkoutProgram.id).all()
+    if not programs:
+        return {'programs': 0, 'users': 0}
+
+    documents = [program_tokens(p.program_type, p.difficulty, p.fitness_level, p.target_muscle_groups,
+                                p.equipment_needed, program_exercise_names(p.exercises)) for p in programs]
+    space = FeatureSpace(app.config['RECOMMENDATION_MAX_FEATURES']).fit(documents)
+    matrix = space.transform(documents)
+    program_ids = np.array([p.id for p in programs])
+    row_of_program = {program_id: row for row, program_id in enumerate(program_ids.tolist())}
+
+    # Only public programs are recommended; column c of the candidates is row public_rows[c]
+    public_rows = np.array([row for row, p in enumerate(programs) if p.is_public], dtype=np.int64)
+    candidates = matrix[public_rows]
+    column_of_row = np.full(len(programs), -1)
+    column_of_row[public_rows] = np.arange(len(public_rows))
+
+    program_rows = []
+    self_pairs = np.arange(len(public_rows))
+    for query, columns, scores in top_k(candidates, candidates, k, chunk_size, exclude=(self_pairs, self_pairs)):
+        program_id = int(program_ids[public_rows[query]])
+        program_rows.extend({
+            'program_id': program_id,
+            'rank': rank,
+            'similar_program_id': int(program_ids[public_rows[column]]),
+            'score': float(score)
+        } for rank, (column, score) in enumerate(zip(columns, scores), start=1))
+
+    workouts = workout_history()
+    history = db.session.query(
+        workouts.c.user_id, workouts.c.program_id, db.func.count(workouts.c.id)
+    ).group_by(workouts.c.user_id, workouts.c.program_id).all()
+    history = [(user_id, row_of_program[program_id], count) for user_id, program_id, count in history
+               if program_id in row_of_program]
+
+    user_rows = []
+    if history:
+        user_ids, user_index = np.unique(np.array([user_id for user_id, _, _ in history]), return_inverse=True)
+        source_rows = np.array([row for _, row, _ in history])
+        counts = np.array([count for _, _, count in history], dtype=np.float32)
+        users = normalize_rows(weighted_sum_rows(matrix, user_index, source_rows, counts))
+
+        # Programs a user already completed are not recommended back
+        done_columns = column_of_row[source_rows]
+        done = done_columns >= 0
+        for query, columns, scores in top_k(users, candidates, k, chunk_size,
+                                            exclude=(user_index[done], done_columns[done])):
+            user_id = int(user_ids[query])
+            user_rows.extend({
+                'user_id': user_id,
+                'rank': rank,
+                'program_id': int(program_ids[public_rows[column]]),
+                'score': float(score)
+            } for rank, (column, score) in enumerate(zip(columns, scores), start=1))
+
+    ProgramRecommendation.query.delete()
+    UserRecommendation.query.delete()
+    for chunk in chunked(program_rows, 5000):
+        db.session.bulk_insert_mappings(ProgramRecommendation, chunk)
+    for chunk in chunked(user_rows, 5000):
+        db.session.bulk_insert_mappings(UserRecommendation, chunk)
+    db.session.commit()
+    return {'programs': len({row['program_id'] for row in program_rows}),
+            'users': len({row['user_id'] for row in user_rows})}
+
+def recommendation_items(rows):
+    return [{
+        'program_id': program.id,
+        'title': program.title,
+        'category': program.category,
+        'difficulty': program.difficulty,
+        'duration': program.duration,
+        'image_filename': program.image_filename,
+        'score': round(score, 4)
+    } for program, score in rows]
+
+@app.route('/api/recommendations')
+@login_required
+def api_recommendations():
+    rows = db.session.query(WorkoutProgram, UserRecommendation.score) \
+        .join(UserRecommendation, UserRecommendation.program_id == WorkoutProgram.id) \
+        .filter(UserRecommendation.user_id == current_user.id) \
+        .order_by(UserRecommendation.rank).all()
+    return jsonify({'success': True, 'items': recommendation_items(rows)})
+
+@app.route('/api/programs/<int:program_id>/similar')
+def api_similar_programs(program_id):
+    rows = db.session.query(WorkoutProgram, ProgramRecommendation.score) \
+        .join(ProgramRecommendation, ProgramRecommendation.similar_program_id == WorkoutProgram.id) \
+        .filter(ProgramRecommendation.program_id == program_id) \
+        .order_by(ProgramRecommendation.rank).all()
+    return jsonify({'success': True, 'items': recommendation_items(rows)})
+
+def leaderboard_period(window, moment):
+    """Start of the leaderboard period of ``window`` that contains ``moment``."""
+    return period_start(LEADERBOARD_WINDOWS[window], moment) or LEADERBOARD_EPOCH
+
+def upsert_leaderboard_entries(rows, accumulate):
+    """Insert or update LeaderboardEntry rows, adding to or replacing the stored totals."""
+    table = LeaderboardEntry.__table__
+    insert = sqlite_insert(table)
+    last = table.c.last_workout_on
+    if accumulate:
+        values = {
+            'workouts': table.c.workouts + insert.excluded.workouts,
+            'minutes': table.c.minutes + insert.excluded.minutes,
+            'last_workout_on': db.case((last > insert.excluded.last_workout_on, last),
+                                       else_=insert.excluded.last_workout_on)
+        }
+    else:
+        values = {name: insert.excluded[name] for name in ('workouts', 'minutes', 'last_workout_on')}
+    values['streak'] = insert.excluded.streak
+    values['updated_at'] = insert.excluded.updated_at
+    statement = insert.on_conflict_do_update(
+        index_elements=[table.c.window, table.c.period_start, table.c.user_id], set_=values)
+    for chunk in chunked(rows, 500):
+        db.session.execute(statement, chunk)
+
+def record_leaderboard_workout(workout):
+    """Add a completed workout to its owner's rows in every leaderboard window."""
+    day = workout.date.date()
+    all_time = db.session.query(LeaderboardEntry.streak, LeaderboardEntry.last_workout_on) \
+        .filter_by(window='all', period_start=LEADERBOARD_EPOCH, user_id=workout.user_id).first()
+    if all_time is None or all_time.last_workout_on is None:
+        streak = 1
+    elif all_time.last_workout_on == day - timedelta(days=1):
+        streak = all_time.streak + 1
+    elif all_time.last_workout_on >= day:
+        streak = all_time.streak
+    else:
+        streak = 1
+    now = datetime.utcnow()
+    upsert_leaderboard_entries([{
+        'window': window,
+        'period_start': leaderboard_period(window, workout.date),
+        'user_id': workout.user_id,
+        'workouts': 1,
+        'minutes': workout.duration or 0,
+        'streak': streak,
+        'last_workout_on': day,
+        'updated_at': now
+    } for window in LEADERBOARD_WINDOWS], accumulate=True)
+
+def current_streaks(user_ids=None):
+    """Map user id to (current streak, last workout day) from the full workout history.
+
+    Consecutive days share ``julianday(day) - row_number()``, so each run of
+    days is one group; the latest run is the current streak unless it ended
+    before yesterday.
+    """
+    history = workout_history()
+    days = db.select(history.c.user_id, db.func.date(history.c.date).label('day')).distinct()
+    if user_ids is not None:
+        days = days.where(history.c.user_id.in_(user_ids))
+    days = days.subquery()
+    runs = db.select(days.c.user_id, days.c.day, (
+        db.func.julianday(days.c.day)
+        - db.func.row_number().over(partition_by=days.c.user_id, order_by=days.c.day)
+    ).label('run')).subquery()
+    islands = db.select(
+        runs.c.user_id, db.func.max(runs.c.day).label('last_day'), db.func.count().label('length')
+    ).group_by(runs.c.user_id, runs.c.run).subquery()
+    latest = db.select(islands, db.func.row_number().over(
+        partition_by=islands.c.user_id, order_by=islands.c.last_day.desc()).label('position')).subquery()
+
+    yesterday = datetime.utcnow().date() - timedelta(days=1)
+    streaks = {}
+    for user_id, last_day, length in db.session.execute(
+            db.select(latest.c.user_id, latest.c.last_day, latest.c.length).where(latest.c.position == 1)):
+        last_day = datetime.strptime(last_day, '%Y-%m-%d').date()
+        streaks[user_id] = (length if last_day >= yesterday else 0, last_day)
+    return streaks
+
+def rebuild_leaderboards(user_ids=None):
+    """Recompute the current periods' leaderboard rows from workout history.
+
+    Used after imports, which bypass record_leaderboard_workout, and as a
+    periodic reconcile. Returns the number of rows written.
+    """
+    now = datetime.utcnow()
+    streaks = current_streaks(user_ids)
+    rows = []
+    for window in LEADERBOARD_WINDOWS:
+        start = leaderboard_period(window, now)
+        history = workout_history(since=start)
+        query = db.session.query(
+            history.c.user_id, db.func.count(history.c.id), db.func.coalesce(db.func.sum(history.c.duration), 0)
+        ).filter(history.c.date >= start).group_by(history.c.user_id)
+        if user_ids is not None:
+            query = query.filter(history.c.user_id.in_(user_ids))
+        for user_id, workouts, minutes in query:
+            streak, last_day = streaks.get(user_id, (0, None))
+            rows.append({'window': window, 'period_start': start, 'user_id': user_id, 'workouts': workouts,
+                         'minutes': minutes, 'streak': streak, 'last_workout_on': last_day, 'updated_at': now})
+    upsert_leaderboard_entries(rows, accumulate=False)
+    db.session.commit()
+    return len(rows)
+
+def roll_leaderboards():
+    """Drop rows of finished periods and zero streaks that ended before yesterday."""
+    now = datetime.utcnow()
+    for window in LEADERBOARD_WINDOWS:
+        LeaderboardEntry.query.filter(LeaderboardEntry.window == window,
+                                      LeaderboardEntry.period_start < leaderboard_period(window, now)) \
+            .delete(synchronize_session=False)
+    LeaderboardEntry.query.filter(LeaderboardEntry.streak > 0,
+                                  LeaderboardEntry.last_workout_on < now.date() - timedelta(days=1)) \
+        .update({'streak': 0, 'updated_at': now}, synchronize_session=False)
+    db.session.commit()
+    sync_leaderboards()
+
+def apply_leaderboard_entry(entry):
+    leaderboards.apply(entry.window, entry.period_start, entry.user_id,
+                       {metric: getattr(entry, metric) for metric in LEADERBOARD_METRICS})
+
+def sync_leaderboards():
+    """Load rank table rows changed since the last sync into the in-process boards.
+
+    A window whose period has rolled over since the last sync is reloaded in
+    full; the others only read rows updated since then, through the
+    updated_at index. The overlap covers rows committed late by the group
+    commit writer; applying a row twice is harmless.
+    """
+    now = datetime.utcnow()
+    since = leaderboards.synced_at
+    for window in LEADERBOARD_WINDOWS:
+        period = leaderboard_period(window, now)
+        query = LeaderboardEntry.query.filter(LeaderboardEntry.window == window,
+                                              LeaderboardEntry.period_start == period)
+        if not leaderboards.start_period(window, period) and since is not None:
+            query = query.filter(LeaderboardEntry.updated_at >= since - timedelta(seconds=60))
+        for entry in query:
+            apply_leaderboard_entry(entry)
+    leaderboards.synced_at = now
+
+def leaderboard_args(window, metric):
+    if window not in LEADERBOARD_WINDOWS or metric not in LEADERBOARD_METRICS:
+        abort(404)
+    synced_at = leaderboards.synced_at
+    if synced_at is None or datetime.utcnow() - synced_at > timedelta(seconds=app.config['LEADERBOARD_SYNC_SECONDS']):
+        sync_leaderboards()
+    return leaderboards.board(window, metric)
+
+@app.route('/api/leaderboards/<window>/<metric>')
+def api_leaderboard(window, metric):
+    """Top of a leaderboard; ``limit`` is capped at LEADERBOARD_SIZE."""
+    board = leaderboard_args(window, metric)
+    limit = max(1, min(request.args.get('limit', app.config['LEADERBOARD_SIZE'], type=int),
+                       app.config['LEADERBOARD_SIZE']))
+    top = board.top(limit)
+    usernames = dict(db.session.query(User.id, User.username).filter(User.id.in_([user_id for user_id, _ in top])))
+    return jsonify({
+        'success': True,
+        'window': window,
+        'metric': metric,
+        'period_start': isoformat(leaderboards.periods[window]),
+        'items': [{'rank': rank, 'user_id': user_id, 'username': usernames.get(user_id), 'score': score}
+                  for rank, (user_id, score) in enumerate(top, start=1)]
+    })
+
+@app.route('/api/leaderboards/<window>/<metric>/me')
+@login_required
+def api_leaderboard_rank(window, metric):
+    """The current user's rank, reading their own row so a fresh workout counts at once."""
+    board = leaderboard_args(window, metric)
+    entry = LeaderboardEntry.query.get((window, leaderboards.periods[window], current_user.id))
+    if entry is not None:
+        apply_leaderboard_entry(entry)
+    ranked = board.rank(current_user.id)
+    return jsonify({
+        'success': True,
+        'window': window,
+        'metric': metric,
+        'rank': ranked[0] if ranked else None,
+        'score': ranked[1] if ranked else 0,
+        'total': len(board)
+    })
+
+def period_start(frequency, moment):
+    """Return the start of the recurring period containing ``moment``, or None for one-off goals."""
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if frequency == 'daily':
+        return day
+    if frequency == 'weekly':
+        return day - timedelta(days=day.weekday())
+    if frequency == 'monthly':
+        return day.replace(day=1)
+    return None
+
+def goal_progress_values(current_value):
+    """Column values that set current_value and recompute progress/is_completed in the same UPDATE."""
+    reached = current_value >= Goal.target_value
+    return {
+        Goal.version: Goal.version + 1,
+        Goal.current_value: current_value,
+        Goal.progress: db.case(
+            (Goal.target_value.is_(None) | (Goal.target_value <= 0), Goal.progress),
+            (reached, 100),
+            else_=db.cast(current_value * 100 / Goal.target_value, db.Integer)
+        ),
+        Goal.is_completed: db.case(
+            (Goal.target_value.is_(None) | (Goal.target_value <= 0), Goal.is_completed),
+            else_=reached
+        )
+    }
+
+def goal_window_filter(moment, now):
+    """Match goals whose current window contains ``moment``."""
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    recurring = [Goal.frequency == frequency for frequency in RECURRING_FREQUENCIES
+                 if moment >= period_start(frequency, now)]
+    one_off = db.and_(
+        db.or_(Goal.frequency.is_(None), Goal.frequency.notin_(RECURRING_FREQUENCIES)),
+        db.or_(Goal.created_at.is_(None), Goal.created_at <= moment),
+        db.or_(Goal.target_date.is_(None), Goal.target_date >= day)
+    )
+    return db.or_(one_off, *recurring)
+
+def apply_workout_to_goals(workout):
+    """Advance the user's workout-tracked goals for a newly logged workout.
+
+    Only active goals measured in minutes, sessions or days whose current
+    window contains the workout are touched, in a single UPDATE.
+    """
+    day = workout.date.replace(hour=0, minute=0, second=0, microsecond=0)
+    first_of_day = not db.session.query(CompletedWorkout.query.filter(
+        CompletedWorkout.user_id == workout.user_id,
+        CompletedWorkout.date >= day,
+        CompletedWorkout.date < day + timedelta(days=1),
+        CompletedWorkout.id < workout.id
+    ).exists()).scalar()
+
+    delta = db.case(
+        (Goal.unit == 'sessions', 1),
+        (Goal.unit == 'minutes', workout.duration or 0),
+        else_=1 if first_of_day else 0
+    )
+    units = [unit for unit in AUTO_PROGRESS_UNITS if unit != 'days' or first_of_day]
+    return Goal.query.filter(
+        Goal.user_id == workout.user_id,
+        Goal.is_completed == False,
+        Goal.unit.in_(units),
+        Goal.target_value > 0,
+        goal_window_filter(workout.date, datetime.utcnow())
+    ).update(goal_progress_values(db.func.coalesce(Goal.current_value, 0) + delta), synchronize_session=False)
+
+def recompute_goal_progress(user_id=None, goal_ids=None):
+    """Rebuild workout-tracked goals from their owners' history in one aggregate query."""
+    now = datetime.utcnow()
+    goals = Goal.query.filter(Goal.unit.in_(AUTO_PROGRESS_UNITS), Goal.target_value > 0)
+    if user_id is not None:
+        goals = goals.filter(Goal.user_id == user_id)
+    if goal_ids is not None:
+        goals = goals.filter(Goal.id.in_(goal_ids))
+
+    # Recurring windows are recent; only one-off goals can reach into archived history
+    oldest = goals.filter(db.or_(Goal.frequency.is_(None), ~Goal.frequency.in_(RECURRING_FREQUENCIES))) \
+        .with_entities(db.func.count(Goal.id), db.func.min(db.func.coalesce(Goal.created_at, datetime.min))).one()
+    history = workout_history(since=oldest[1] if oldest[0] else now)
+
+    window_start = db.case(
+        *[(Goal.frequency == frequency, period_start(frequency, now)) for frequency in RECURRING_FREQUENCIES],
+        else_=Goal.created_at
+    )
+    joined = db.and_(
+        history.c.user_id == Goal.user_id,
+        db.or_(window_start.is_(None), history.c.date >= window_start),
+        db.or_(Goal.target_date.is_(None), Goal.frequency.in_(RECURRING_FREQUENCIES),
+               db.func.date(history.c.date) <= db.func.date(Goal.target_date))
+    )
+    query = goals.with_entities(
+        Goal.id,
+        Goal.version,
+        Goal.unit,
+        Goal.target_value,
+        db.func.count(history.c.id),
+        db.func.coalesce(db.func.sum(history.c.duration), 0),
+        db.func.count(db.distinct(db.func.date(history.c.date)))
+    ).outerjoin(history, joined).group_by(Goal.id, Goal.version, Goal.unit, Goal.target_value)
+
+    updates = []
+    for goal_id, version, unit, target_value, sessions, minutes, days in query:
+        current_value = {'sessions': sessions, 'minutes': minutes, 'days': days}[unit]
+        updates.append({
+            'id': goal_id,
+            'version': version + 1,
+            'current_value': current_value,
+            'progress': min(int(current_value * 100 / target_value), 100),
+            'is_completed': current_value >= target_value
+        })
+    db.session.bulk_update_mappings(Goal, updates)
+    return len(updates)
+
+def scan_due_goals(criteria, batch_size, max_batches):
+    """Yield batches of active, not yet overdue goal ids matching ``criteria``.
+
+    Reads a range of the (is_completed, is_overdue, target_date) index. The
+    caller must update every goal in a batch so it no longer matches; the
+    flags it sets serve as the checkpoint, so each batch starts again at the
+    front of the range and goals created with an earlier target date than
+    the ones already handled are still found. The caller's changes are
+    committed after each batch.
+    """
+    for _ in range(max_batches):
+        goal_ids = [goal_id for (goal_id,) in db.session.query(Goal.id).filter(
+            Goal.is_completed == False,
+            Goal.is_overdue == False,
+            *criteria
+        ).order_by(Goal.target_date, Goal.id).limit(batch_size)]
+        if not goal_ids:
+            return
+        yield goal_ids
+        db.session.commit()
+        if len(goal_ids) < batch_size:
+            return
+
+def sweep_goals(now=None):
+    """Flag overdue and due-soon goals and reset recurring goals whose period rolled over."""
+    now = now or datetime.utcnow()
+    batch_size = app.config['GOAL_SWEEP_BATCH_SIZE']
+    max_batches = app.config['GOAL_SWEEP_MAX_BATCHES']
+    counts = {'overdue': 0, 'due_soon': 0, 'reset': 0}
+
+    # Target dates are whole days, so a goal is overdue once its day has ended
+    overdue_until = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(microseconds=1)
+    for goal_ids in scan_due_goals([Goal.target_date <= overdue_until], batch_size, max_batches):
+        counts['overdue'] += Goal.query.filter(Goal.id.in_(goal_ids)).update(
+            {Goal.is_overdue: True}, synchronize_session=False)
+
+    # A bounded window rescanned every run; reminded goals stay in it but are skipped
+    due_soon_until = now + timedelta(hours=app.config['GOAL_DUE_SOON_HOURS'])
+    due_soon = [Goal.target_date > overdue_until, Goal.target_date <= due_soon_until, Goal.reminded_at.is_(None)]
+    for goal_ids in scan_due_goals(due_soon, batch_size, max_batches):
+        counts['due_soon'] += Goal.query.filter(Goal.id.in_(goal_ids)).update(
+            {Goal.reminded_at: now}, synchronize_session=False)
+
+    for frequency in RECURRING_FREQUENCIES:
+        boundary = period_start(frequency, now)
+        # Two range scans on (frequency, period_start); reset rows leave the range
+        for stale in (Goal.period_start.is_(None), Goal.period_start < boundary):
+            for _ in range(max_batches):
+                goal_ids = [goal_id for (goal_id,) in db.session.query(Goal.id).filter(
+                    Goal.frequency == frequency, stale
+                ).limit(batch_size)]
+                if not goal_ids:
+                    break
+                Goal.query.filter(Goal.id.in_(goal_ids)).update({
+                    Goal.period_start: boundary,
+                    Goal.current_value: 0,
+                    Goal.progress: 0,
+                    Goal.is_completed: False,
+                    Goal.is_overdue: False,
+                    Goal.version: Goal.version + 1
+                }, synchronize_session=False)
+                # Workouts already logged in the new period count toward it
+                recompute_goal_progress(goal_ids=goal_ids)
+                db.session.commit()
+                counts['reset'] += len(goal_ids)
+                if len(goal_ids) < batch_size:
+                    break
+
+    db.session.commit()
+    return counts
+
 @app.route('/goals')
 @login_required
 def goals():
-    active_goals = Goal.query.filter_by(
-        user_id=current_user.id,
-        is_completed=False
-    ).all()
-    completed_goals = Goal.query.filter_by(
-        user_id=current_user.id,
-        is_completed=True
+    # Active goals first, then by priority and due date, in a single scan
+    user_goals = Goal.query.filter_by(user_id=current_user.id).order_by(
+        Goal.is_completed, Goal.priority.desc(), Goal.target_date
     ).all()
+    active_goals = [goal for goal in user_goals if not goal.is_completed]
+    completed_goals = [goal for goal in user_goals if goal.is_completed]
     return render_template('goals.html', 
                          active_goals=active_goals,
                          completed_goals=completed_goals)
@@ -688,21 +2176,19 @@ def create_goal():
         unit = request.form.get('unit')
         progress = int(request.form.get('progress', 0))
         
-        goal = Goal(
-            title=title,
-            description=description,
-            target_date=target_date,
-            category=category,
-            priority=priority,
-            frequency=frequency,
-            target_value=float(target_value) if target_value else None,
-            unit=unit if unit else None,
-            current_value=float(target_value) * (progress / 100) if target_value else None,
-            progress=progress,
-            user_id=current_user.id
-        )
-        db.session.add(goal)
-        db.session.commit()
+        writer.run(insert_goal, current_user.id, {
+            'title': title,
+            'description': description,
+            'target_date': target_date,
+            'category': category,
+            'priority': priority,
+            'frequency': frequency,
+            'target_value': float(target_value) if target_value else None,
+            'unit': unit if unit else None,
+            'current_value': float(target_value) * (progress / 100) if target_value else None,
+            'progress': progress,
+            'period_start': period_start(frequency, datetime.utcnow())
+        })
 
         if is_xhr():
             return jsonify({'success': True, 'message': 'Мақсат сәтті құрылды!'})
@@ -711,6 +2197,16 @@ def create_goal():
 
     return render_template('create_goal.html')
 
+def insert_goal(user_id, values):
+    """Write intent of create_goal; returns the new goal id."""
+    goal = Goal(user_id=user_id, **values)
+    db.session.add(goal)
+    db.session.flush()
+    if goal.unit in AUTO_PROGRESS_UNITS:
+        recompute_goal_progress(user_id, goal_ids=[goal.id])
+    outbox.publish('GoalUpdated', user_id=user_id, goal_ids=[goal.id], completed=[])
+    return goal.id
+
 @app.route('/update_goal_progress/<int:goal_id>', methods=['POST'])
 @login_required
 def update_goal_progress(goal_id):
@@ -724,43 +2220,145 @@ def update_goal_progress(goal_id):
     if request.is_json:
         data = request.get_json()
         progress = data.get('progress', 0)
+        version = data.get('version')
     else:
         progress = request.form.get('progress', 0)
+        version = request.form.get('version')
     
     try:
         progress = int(progress)
+        version = int(version) if version not in (None, '') else None
         if not 0 <= progress <= 100:
             raise ValueError
-    except ValueError:
+    except (TypeError, ValueError):
         if is_xhr():
             return jsonify({'success': False, 'message': 'Прогресс 0-100 аралығында болуы керек'})
         flash('Прогресс 0-100 аралығында болуы керек', 'danger')
         return redirect(url_for('goals'))
     
-    goal.progress = progress
-    goal.is_completed = (progress == 100)
-    db.session.commit()
+    updated, current_version = writer.run(write_goal_progress, current_user.id, goal_id, progress, version)
+    
+    if not updated:
+        if is_xhr():
+            return jsonify({'success': False, 'message': MESSAGES['goal_conflict'], 'version': current_version}), 409
+        flash(MESSAGES['goal_conflict'], 'warning')
+        return redirect(url_for('goals'))
     
     if is_xhr():
         return jsonify({
             'success': True, 
             'message': 'Мақсат прогресі сәтті жаңартылды',
             'progress': progress,
-            'is_completed': goal.is_completed
+            'is_completed': progress == 100,
+            'version': current_version
         })
     
     flash('Мақсат прогресі сәтті жаңартылды', 'success')
     return redirect(url_for('goals'))
 
+def write_goal_progress(user_id, goal_id, progress, version):
+    """Write intent of update_goal_progress; returns (rows updated, the goal's current version)."""
+    was_completed = db.session.query(Goal.is_completed).filter_by(id=goal_id, user_id=user_id).scalar()
+    # Atomic write; a stale version means another tab or device updated the goal first
+    query = Goal.query.filter(Goal.id == goal_id, Goal.user_id == user_id)
+    if version is not None:
+        query = query.filter(Goal.version == version)
+    updated = query.update({
+        Goal.progress: progress,
+        Goal.is_completed: progress == 100,
+        Goal.version: Goal.version + 1
+    }, synchronize_session=False)
+    if updated:
+        outbox.publish('GoalUpdated', user_id=user_id, goal_ids=[goal_id],
+                       completed=[goal_id] if progress == 100 and not was_completed else [])
+    return updated, db.session.query(Goal.version).filter_by(id=goal_id).scalar()
+
+@outbox.handler('GoalUpdated')
+def publish_goal_activity(events):
+    """Post completed goals to the owners' followers."""
+    goal_ids = [goal_id for event in events for goal_id in event.data['completed']]
+    if not goal_ids:
+        return
+    titles = dict(db.session.query(Goal.id, Goal.title).filter(Goal.id.in_(goal_ids)))
+    for event in events:
+        for goal_id in event.data['completed']:
+            if goal_id in titles:
+                publish_activity(event.data['user_id'], 'goal', detail=titles[goal_id], created_at=event.created_at)
+
+@app.route('/api/goals/progress', methods=['POST'])
+@login_required
+def api_goals_progress():
+    """Apply a batch of progress deltas atomically in one transaction.
+
+    Body: {"updates": [{"goal_id": 1, "delta": 20, "version": 3}, ...]}; the
+    version is optional and turns the update into a compare-and-set.
+    """
+    data = request.get_json(silent=True) or {}
+    updates = data.get('updates')
+    if not isinstance(updates, list) or not updates:
+        return jsonify({'success': False, 'message': 'updates тізімі бос'}), 400
+    if len(updates) > app.config['GOAL_PROGRESS_BATCH_LIMIT']:
+        return jsonify({'success': False,
+                        'message': f'Бір сұраныста ең көбі {app.config["GOAL_PROGRESS_BATCH_LIMIT"]} жаңарту'}), 400
+
+    parsed = []
+    for index, item in enumerate(updates):
+        try:
+            goal_id = int(item['goal_id'])
+            delta = float(item['delta'])
+            version = int(item['version']) if item.get('version') is not None else None
+            if delta != delta or delta in (float('inf'), float('-inf')):
+                raise ValueError
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'success': False, 'message': f'updates[{index}]: goal_id және delta сан болуы керек'}), 400
+        parsed.append((goal_id, delta, version))
+
+    conflicts = set()
+    goal_ids = {goal_id for goal_id, _, _ in parsed}
+    open_goals = {goal_id for (goal_id,) in db.session.query(Goal.id).filter(
+        Goal.id.in_(goal_ids), Goal.user_id == current_user.id, Goal.is_completed == False)}
+    for goal_id, delta, version in parsed:
+        query = Goal.query.filter(Goal.id == goal_id, Goal.user_id == current_user.id)
+        if version is not None:
+            query = query.filter(Goal.version == version)
+        new_value = db.func.coalesce(Goal.current_value, 0) + delta
+        new_value = db.case((new_value < 0, 0), else_=new_value)
+        if not query.update(goal_progress_values(new_value), synchronize_session=False):
+            conflicts.add(goal_id)
+
+    rows = db.session.query(Goal.id, Goal.version, Goal.current_value, Goal.progress, Goal.is_completed).filter(
+        Goal.id.in_(goal_ids), Goal.user_id == current_user.id
+    ).all()
+    found = {row.id for row in rows}
+    applied = sorted(found - conflicts)
+    if applied:
+        outbox.publish('GoalUpdated', user_id=current_user.id, goal_ids=applied,
+                       completed=[row.id for row in rows if row.is_completed and row.id in open_goals])
+    db.session.commit()
+    return jsonify({
+        'success': not conflicts,
+        'goals': [{
+            'goal_id': row.id,
+            'version': row.version,
+            'current_value': row.current_value,
+            'progress': row.progress,
+            'is_completed': row.is_completed,
+            'status': 'conflict' if row.id in conflicts else 'applied'
+        } for row in rows],
+        'not_found': sorted(goal_ids - found)
+    }), 409 if conflicts & found else 200
+
 @app.route('/programs')
+@replica.reads
 def programs():
     # Получаем параметры фильтрации
     program_type = request.args.get('program_type')
     level = request.args.get('level')
     duration = request.args.get('duration')
+    sort = request.args.get('sort')
 
-    # Базовый запрос
-    query = WorkoutProgram.query.filter(
+    # Базовый запрос; counters come along in the same query
+    query = WorkoutProgram.query.outerjoin(ProgramStats).options(db.contains_eager(WorkoutProgram.stats)).filter(
         (WorkoutProgram.is_public == True) | 
         (WorkoutProgram.user_id == current_user.id if current_user.is_authenticated else False)
     )
@@ -772,13 +2370,16 @@ def programs():
         query = query.filter_by(difficulty=level)
     if duration:
         query = query.filter_by(duration=int(duration))
+    if sort == 'popular':
+        query = query.order_by(ProgramStats.popularity.desc(), WorkoutProgram.id)
 
     # Получаем программы
     programs = query.all()
 
-    return render_template('programs.html', programs=programs)
+    return render_template('programs.html', programs=programs, sort=sort)
 
 @app.route('/view_program/<int:program_id>')
+@replica.reads
 def view_program(program_id):
     program = WorkoutProgram.query.get_or_404(program_id)
     
@@ -808,6 +2409,224 @@ def view_program(program_id):
                          program=program,
                          day_exercises=day_exercises)
 
+def resolve_import_program(record, user_id, program_ids):
+    """Map an imported row to a program id, creating a private program for unknown titles."""
+    program_id = parse_int(record.get('program_id'), 'program_id', minimum=1)
+    if program_id is not None:
+        key = ('id', program_id)
+        if key not in program_ids:
+            visible = db.session.query(WorkoutProgram.id).filter(
+                WorkoutProgram.id == program_id,
+                (WorkoutProgram.is_public == True) | (WorkoutProgram.user_id == user_id)
+            ).first()
+            program_ids[key] = program_id if visible else None
+        if program_ids[key] is None:
+            raise ImportRowError(f'program_id: {program_id} бағдарламасы табылмады')
+        return program_ids[key]
+
+    title = clean(record.get('program') or record.get('program_title') or record.get('title'))
+    if not title:
+        raise ImportRowError('program: бағдарлама көрсетілмеген')
+    title = title[:100]
+    key = ('title', title)
+    if key not in program_ids:
+        row = db.session.query(WorkoutProgram.id).filter(
+            WorkoutProgram.title == title,
+            (WorkoutProgram.is_public == True) | (WorkoutProgram.user_id == user_id)
+        ).order_by((WorkoutProgram.user_id == user_id).desc()).first()
+        if row:
+            program_ids[key] = row.id
+        else:
+            program = WorkoutProgram(title=title, user_id=user_id, is_public=False)
+            db.session.add(program)
+            db.session.flush()
+            program_ids[key] = program.id
+    return program_ids[key]
+
+def map_import_record(record, user_id, program_ids):
+    """Validate an imported row and map it to CompletedWorkout or Goal column values."""
+    if record is None:
+        raise ImportRowError('жол JSON объектісі емес')
+
+    kind = (clean(record.get('type')) or 'workout').lower()
+    if kind == 'workout':
+        date = parse_datetime(record.get('date'), 'date')
+        if date is None:
+            raise ImportRowError('date: күн көрсетілмеген')
+        intensity = (clean(record.get('intensity')) or '').lower()
+        return kind, {
+            'user_id': user_id,
+            'program_id': resolve_import_program(record, user_id, program_ids),
+            'date': date,
+            'notes': clean(record.get('notes')),
+            'rating': parse_int(record.get('rating'), 'rating', minimum=1, maximum=5),
+            'duration': parse_int(record.get('duration'), 'duration', minimum=1),
+            'intensity': intensity if intensity in WORKOUT_INTENSITIES else None,
+            'calories_burn': parse_int(record.get('calories_burn') or record.get('calories'), 'calories_burn', minimum=0)
+        }
+
+    if kind == 'goal':
+        title = clean(record.get('title'))
+        if not title:
+            raise ImportRowError('title: мақсат атауы көрсетілмеген')
+        target_value = parse_float(record.get('target_value'), 'target_value', minimum=0)
+        current_value = parse_float(record.get('current_value'), 'current_value', minimum=0)
+        progress = parse_int(record.get('progress'), 'progress', minimum=0, maximum=100)
+        frequency = clean(record.get('frequency'))
+        if progress is None:
+            progress = round(min(current_value / target_value * 100, 100)) if target_value and current_value else 0
+        return kind, {
+            'user_id': user_id,
+            'title': title[:100],
+            'description': clean(record.get('description')),
+            'target_date': parse_datetime(record.get('target_date'), 'target_date'),
+            'category': clean(record.get('category')) or 'General',
+            'priority': parse_int(record.get('priority'), 'priority', minimum=1, maximum=5) or 1,
+            'frequency': frequency,
+            'period_start': period_start(frequency, datetime.utcnow()),
+            'target_value': target_value,
+            'current_value': current_value,
+            'unit': clean(record.get('unit')),
+            'progress': progress,
+            'is_completed': parse_bool(record.get('is_completed')) or progress == 100
+        }
+
+    raise ImportRowError(f'type: белгісіз жазба түрі "{kind}"')
+
+def run_import(job_id, stream, fmt, progress_callback=None):
+    """Import a CSV/JSONL stream for an import job in chunked transactions."""
+    job = ImportJob.query.get(job_id)
+    job.status = 'running'
+    db.session.commit()
+
+    chunk_size = app.config['IMPORT_CHUNK_SIZE']
+    max_errors = app.config['IMPORT_MAX_ERRORS']
+    errors = []
+    program_ids = {}
+    touched_programs = set()
+    # Imported goals keep the progress in the file and completed goals stay
+    # completed; only goals already open before the import follow the new workouts
+    open_goals = [goal_id for (goal_id,) in db.session.query(Goal.id).filter(
+        Goal.user_id == job.user_id, Goal.is_completed == False, Goal.unit.in_(AUTO_PROGRESS_UNITS))]
+    try:
+        for chunk in chunked(iter_records(stream, fmt), chunk_size):
+            workouts, goals = [], []
+            for line_no, record in chunk:
+                try:
+                    kind, values = map_import_record(record, job.user_id, program_ids)
+                except ImportRowError as e:
+                    job.rows_skipped += 1
+                    if len(errors) < max_errors:
+                        errors.append(f'{line_no}: {e}')
+                    continue
+                (workouts if kind == 'workout' else goals).append(values)
+                if kind == 'workout':
+                    touched_programs.add(values['program_id'])
+
+            if workouts:
+                db.session.bulk_insert_mappings(CompletedWorkout, workouts)
+            if goals:
+                db.session.bulk_insert_mappings(Goal, goals)
+            job.rows_read += len(chunk)
+            job.rows_imported += len(workouts) + len(goals)
+            job.errors = json.dumps(errors, ensure_ascii=False)
+            db.session.commit()
+            if progress_callback:
+                progress_callback(job)
+
+        # Derived stats are rebuilt once for the whole file, not per row
+        if touched_programs and open_goals:
+            recompute_goal_progress(job.user_id, goal_ids=open_goals)
+        award_achievements(job.user_id)
+        db.session.commit()
+        if touched_programs:
+            reconcile_program_stats(sorted(touched_programs))
+            rebuild_leaderboards([job.user_id])
+        db.session.commit()
+        job.status = 'done'
+    except Exception as e:
+        db.session.rollback()
+        job = ImportJob.query.get(job_id)
+        job.status = 'failed'
+        errors.append(str(e))
+        job.errors = json.dumps(errors[-max_errors:], ensure_ascii=False)
+        app.logger.exception('Import job %s failed', job_id)
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return job
+
+def run_import_file(job_id, path, fmt):
+    """Run an import job from a spooled upload in a background thread."""
+    with app.app_context():
+        try:
+            with open(path, 'rb') as stream:
+                run_import(job_id, stream, fmt)
+        finally:
+            db.session.remove()
+            os.remove(path)
+
+@app.route('/import_history', methods=['POST'])
+@login_required
+@limiter.limit('import_history')
+def import_history():
+    file = request.files.get('file')
+    if not file or file.filename == '':
+        return jsonify({'success': False, 'message': 'Файл таңдалмаған'}), 400
+
+    fmt = request.form.get('format') or detect_format(file.filename)
+    if fmt not in SUPPORTED_FORMATS:
+        return jsonify({'success': False, 'message': MESSAGES['file_not_allowed']}), 400
+
+    # Spool the upload to disk so the worker thread never holds it in memory
+    fd, path = tempfile.mkstemp(prefix='import-', suffix=f'.{fmt}')
+    with os.fdopen(fd, 'wb') as spool:
+        file.save(spool)
+
+    job = ImportJob(id=uuid.uuid4().hex, user_id=current_user.id, filename=secure_filename(file.filename))
+    db.session.add(job)
+    db.session.commit()
+
+    threading.Thread(target=run_import_file, args=(job.id, path, fmt), daemon=True).start()
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': url_for('import_status', job_id=job.id)
+    }), 202
+
+@app.route('/import_history/<job_id>')
+@login_required
+def import_status(job_id):
+    job = ImportJob.query.get_or_404(job_id)
+    if job.user_id != current_user.id:
+        return jsonify({'success': False, 'message': 'Рұқсат етілмеген'}), 403
+    return jsonify(job.to_dict())
+
+@app.cli.command('import-history')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user', 'username', required=True, help='Username that owns the imported history.')
+@click.option('--format', 'fmt', type=click.Choice(SUPPORTED_FORMATS), help='Defaults to the file extension.')
+def import_history_command(path, username, fmt):
+    """Import workout and goal history from a CSV or JSONL file."""
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        raise click.ClickException(f'Unknown user: {username}')
+    fmt = fmt or detect_format(path)
+    if fmt not in SUPPORTED_FORMATS:
+        raise click.ClickException('Cannot detect format, pass --format')
+
+    job = ImportJob(id=uuid.uuid4().hex, user_id=user.id, filename=os.path.basename(path))
+    db.session.add(job)
+    db.session.commit()
+
+    def report(job):
+        click.echo(f'{job.rows_read} rows read, {job.rows_imported} imported, {job.rows_skipped} skipped')
+
+    with open(path, 'rb') as stream:
+        job = run_import(job.id, stream, fmt, progress_callback=report)
+    for error in json.loads(job.errors or '[]'):
+        click.echo(f'  {error}', err=True)
+    click.echo(f'Import {job.id} {job.status}')
+
 @app.template_filter('from_json')
 def from_json(value):
     try:
@@ -1117,6 +2936,7 @@ def add_sample_exercises():
         db.session.commit()
 
 @app.route('/exercises')
+@replica.reads
 def exercises():
     # Get filter parameters
     muscle_group = request.args.get('muscle_group', 'All')
@@ -1137,8 +2957,9 @@ def exercises():
     # Get exercises
     exercises = query.all()
 
-    # Translate categories for display
+    # Translate categories for display; detach first so the edits are never flushed
     for exercise in exercises:
+        db.session.expunge(exercise)
         exercise.muscle_group = MUSCLE_GROUP_TRANSLATIONS.get(exercise.muscle_group, exercise.muscle_group)
         exercise.difficulty = DIFFICULTY_TRANSLATIONS.get(exercise.difficulty, exercise.difficulty)
         if exercise.equipment:
@@ -1157,6 +2978,197 @@ def exercises():
                          difficulties=list(DIFFICULTY_TRANSLATIONS.values()),
                          equipment_list=list(EQUIPMENT_TRANSLATIONS.values()))
 
+# Versioned JSON API for mobile clients with updated_at delta sync
+api_v1 = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+def isoformat(value):
+    return value.isoformat() if value else None
+
+def serialize_program(program):
+    return {
+        'id': program.id,
+        'title': program.title,
+        'description': program.description,
+        'category': program.category,
+        'difficulty': program.difficulty,
+        'duration': program.duration,
+        'is_public': program.is_public,
+        'user_id': program.user_id,
+        'program_type': program.program_type,
+        'fitness_level': program.fitness_level,
+        'target_muscle_groups': program.target_muscle_groups,
+        'equipment_needed': program.equipment_needed,
+        'workout_frequency': program.workout_frequency,
+        'calories_burn': program.calories_burn,
+        'image_filename': program.image_filename,
+        'exercises': program.exercises,
+        'updated_at': isoformat(program.updated_at)
+    }
+
+def serialize_workout(workout):
+    return {
+        'id': workout.id,
+        'program_id': workout.program_id,
+        'date': isoformat(workout.date),
+        'duration': workout.duration,
+        'intensity': workout.intensity,
+        'calories_burn': workout.calories_burn,
+        'rating': workout.rating,
+        'notes': workout.notes,
+        'updated_at': isoformat(workout.updated_at)
+    }
+
+def serialize_goal(goal):
+    return {
+        'id': goal.id,
+        'title': goal.title,
+        'description': goal.description,
+        'category': goal.category,
+        'target_date': isoformat(goal.target_date),
+        'target_value': goal.target_value,
+        'current_value': goal.current_value,
+        'unit': goal.unit,
+        'frequency': goal.frequency,
+        'priority': goal.priority,
+        'progress': goal.progress,
+        'is_completed': goal.is_completed,
+        'is_overdue': goal.is_overdue,
+        'version': goal.version,
+        'updated_at': isoformat(goal.updated_at)
+    }
+
+def serialize_achievement(achievement):
+    return {
+        'id': achievement.id,
+        'name': achievement.name,
+        'description': achievement.description,
+        'icon': achievement.icon,
+        'date_earned': isoformat(achievement.date_earned),
+        'updated_at': isoformat(achievement.updated_at)
+    }
+
+def parse_utc(text):
+    """Parse an ISO timestamp into the naive UTC datetime the database stores."""
+    value = datetime.fromisoformat(text[:-1] if text.endswith('Z') else text)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def parse_sync_cursor(args):
+    """Return the (updated_at, id) position after which rows are sent.
+
+    ``cursor`` (``updated_at|id`` from a previous page) wins over
+    ``updated_since``, an ISO timestamp from the last completed sync.
+    Timestamps with an offset are converted to UTC.
+    """
+    cursor = args.get('cursor')
+    if cursor:
+        updated_text, id_text = cursor.rsplit('|', 1)
+        return parse_utc(updated_text), int(id_text)
+    since = args.get('updated_since')
+    if since:
+        return parse_utc(since), None
+    return None, None
+
+def sync_collection(entity, source, scope, serialize):
+    """Serve one page of a collection in (updated_at, id) order with an ETag.
+
+    ``source`` is a model or a selectable with ``id`` and ``updated_at``
+    columns, such as the workout history union. The ETag is derived from
+    the row count and newest updated_at of the whole collection plus its
+    tombstones, so an unchanged collection is answered with 304 after two
+    aggregate queries and no rows are loaded.
+
+    The group commit writer can commit a row whose updated_at is older than
+    a sync token already handed out, so an ``updated_since`` scan starts
+    SYNC_OVERLAP_SECONDS earlier. Rows and deletions in the overlap are sent
+    again; each id appears once per response and clients upsert by id.
+    """
+    model = getattr(source, 'c', source)
+    try:
+        since, since_id = parse_sync_cursor(request.args)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Жарамсыз курсор'}), 400
+    limit = request.args.get('limit', app.config['SYNC_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['SYNC_MAX_PAGE_SIZE']))
+
+    tombstones = SyncTombstone.query.filter(
+        SyncTombstone.entity == entity,
+        db.or_(SyncTombstone.user_id == current_user.id, SyncTombstone.user_id.is_(None))
+    )
+    count, latest = db.session.query(db.func.count(model.id), db.func.max(model.updated_at)).filter(scope).one()
+    deleted_count, deleted_latest = tombstones.with_entities(
+        db.func.count(SyncTombstone.id), db.func.max(SyncTombstone.deleted_at)).one()
+    fingerprint = f'{entity}:{current_user.id}:{request.query_string.decode()}:{count}:{latest}:{deleted_count}:{deleted_latest}'
+    etag = hashlib.sha1(fingerprint.encode()).hexdigest()
+    # Weak comparison: compressed responses carry the weak form of the ETag
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    scan_from = since
+    if since is not None and since_id is None:
+        scan_from = since - timedelta(seconds=app.config['SYNC_OVERLAP_SECONDS'])
+
+    query = db.session.query(source).filter(scope)
+    if since is not None:
+        if since_id is None:
+            query = query.filter(model.updated_at > scan_from)
+        else:
+            query = query.filter(db.or_(
+                model.updated_at > since,
+                db.and_(model.updated_at == since, model.id > since_id)
+            ))
+    rows = query.order_by(model.updated_at, model.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    deleted = []
+    if since is not None:
+        deleted = sorted({entity_id for (entity_id,) in tombstones.filter(SyncTombstone.deleted_at > scan_from)
+                          .with_entities(SyncTombstone.entity_id)})
+
+    sync_token = since
+    if rows:
+        sync_token = max(sync_token, rows[-1].updated_at) if sync_token else rows[-1].updated_at
+    response = jsonify({
+        'items': [serialize(row) for row in rows],
+        'deleted': deleted,
+        'next_cursor': f'{rows[-1].updated_at.isoformat()}|{rows[-1].id}' if has_more else None,
+        'sync_token': isoformat(sync_token)
+    })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@api_v1.before_request
+def api_v1_authenticate():
+    if not current_user.is_authenticated:
+        return jsonify({'success': False, 'message': 'Жүйеге кіру қажет'}), 401
+
+@api_v1.route('/programs')
+def api_v1_programs():
+    scope = db.or_(WorkoutProgram.is_public == True, WorkoutProgram.user_id == current_user.id)
+    return sync_collection('programs', WorkoutProgram, scope, serialize_program)
+
+@api_v1.route('/workouts')
+def api_v1_workouts():
+    # Archived workouts are part of the history a new device has to download
+    history = workout_history()
+    return sync_collection('workouts', history, history.c.user_id == current_user.id, serialize_workout)
+
+@api_v1.route('/goals')
+def api_v1_goals():
+    return sync_collection('goals', Goal, Goal.user_id == current_user.id, serialize_goal)
+
+@api_v1.route('/achievements')
+def api_v1_achievements():
+    return sync_collection('achievements', Achievement, Achievement.user_id == current_user.id,
+                           serialize_achievement)
+
+app.register_blueprint(api_v1)
+
 def request_wants_json():
     """Check if the request prefers JSON response."""
     if not has_request_context():
@@ -1171,6 +3183,154 @@ def is_xhr():
         return False
     return request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request_wants_json()
 
+@app.errorhandler(429)
+def too_many_requests(e):
+    if is_xhr():
+        response = jsonify({'success': False, 'message': MESSAGES['rate_limited']})
+        response.status_code = 429
+        response.headers['Retry-After'] = e.retry_after
+        return response
+    return e
+
+def scheduled_job(func):
+    """Run a periodic job inside an application context with a fresh session."""
+    @wraps(func)
+    def wrapper():
+        with app.app_context():
+            try:
+                return func()
+            except Exception:
+                app.logger.exception('Scheduled job %s failed', func.__name__)
+            finally:
+                db.session.remove()
+    return wrapper
+
+scheduler_lock = threading.Lock()
+
+def init_scheduler(shared_jobs=True, process_jobs=True):
+    """Register the periodic jobs and start the background scheduler.
+
+    Process jobs keep this process's in-memory state in step with the
+    database: the program counter buffer and the leaderboards. Every process
+    that serves requests needs them. Shared jobs work on the database alone
+    and need to run in one process only.
+    """
+    with scheduler_lock:
+        if scheduler.running:
+            return
+        if process_jobs:
+            add_process_jobs()
+        if shared_jobs:
+            add_shared_jobs()
+        scheduler.start()
+
+def add_process_jobs():
+    scheduler.add_job(scheduled_job(flush_program_stats), 'interval', id='flush_program_stats',
+                      seconds=app.config['PROGRAM_STATS_FLUSH_SECONDS'], max_instances=1, coalesce=True)
+    scheduler.add_job(scheduled_job(sync_leaderboards), 'interval', id='sync_leaderboards',
+                      seconds=app.config['LEADERBOARD_SYNC_SECONDS'], max_instances=1, coalesce=True)
+    # Counters buffered since the last flush are written on a clean shutdown
+    atexit.register(scheduled_job(flush_program_stats))
+
+def add_shared_jobs():
+    scheduler.add_job(scheduled_job(sweep_goals), 'interval', id='sweep_goals',
+                      minutes=app.config['GOAL_SWEEP_INTERVAL_MINUTES'], max_instances=1, coalesce=True)
+    scheduler.add_job(scheduled_job(reconcile_program_stats), 'interval', id='reconcile_program_stats',
+                      hours=app.config['PROGRAM_STATS_RECONCILE_HOURS'], max_instances=1, coalesce=True)
+    scheduler.add_job(scheduled_job(build_recommendations), 'interval', id='build_recommendations',
+                      hours=app.config['RECOMMENDATION_REFRESH_HOURS'], max_instances=1, coalesce=True)
+    scheduler.add_job(scheduled_job(limiter.purge), 'interval', id='purge_rate_limits',
+                      hours=1, max_instances=1, coalesce=True)
+    scheduler.add_job(scheduled_job(sessions.sweep), 'interval', id='sweep_sessions',
+                      hours=1, max_instances=1, coalesce=True)
+    scheduler.add_job(scheduled_job(archive_workouts), 'interval', id='archive_workouts',
+                      hours=24, max_instances=1, coalesce=True)
+    scheduler.add_job(scheduled_job(outbox.purge), 'interval', id='purge_outbox',
+                      hours=1, max_instances=1, coalesce=True)
+    scheduler.add_job(scheduled_job(trim_feeds), 'interval', id='trim_feeds',
+                      hours=1, max_instances=1, coalesce=True)
+    scheduler.add_job(scheduled_job(roll_leaderboards), 'interval', id='roll_leaderboards',
+                      hours=1, max_instances=1, coalesce=True)
+    scheduler.add_job(scheduled_job(rebuild_leaderboards), 'interval', id='rebuild_leaderboards',
+                      hours=app.config['LEADERBOARD_REBUILD_HOURS'], max_instances=1, coalesce=True)
+    if replica.refreshable:
+        scheduler.add_job(scheduled_job(replica.refresh), 'interval', id='refresh_replica',
+                          seconds=app.config['READ_REPLICA_REFRESH_SECONDS'], max_instances=1, coalesce=True,
+                          next_run_time=datetime.now())
+
+@app.before_request
+def start_scheduler():
+    # Only processes that serve requests get here, so the reloader's file watcher never runs jobs
+    if not scheduler.running and not app.testing:
+        init_scheduler(shared_jobs=app.config['SCHEDULER_ENABLED'])
+
+@app.cli.command('run-scheduler')
+def run_scheduler_command():
+    """Run the shared periodic jobs in the foreground until interrupted."""
+    init_scheduler(process_jobs=False)
+    click.echo(f'Running {len(scheduler.get_jobs())} periodic jobs; press Ctrl+C to stop')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        scheduler.shutdown()
+
+@app.cli.command('sweep-goals')
+def sweep_goals_command():
+    """Run the goal deadline sweeper once."""
+    counts = sweep_goals()
+    click.echo(f"{counts['overdue']} overdue, {counts['due_soon']} due soon, {counts['reset']} reset")
+
+@app.cli.command('calibrate-password-hash')
+@click.option('--target-ms', default=250, show_default=True, help='Acceptable time for one hash.')
+def calibrate_password_hash_command(target_ms):
+    """Find the PBKDF2 iteration count that meets a per-hash latency target."""
+    method, elapsed = calibrate(target_ms / 1000.0)
+    click.echo(f'{method} takes {elapsed * 1000:.0f} ms per hash')
+    click.echo(f"app.config['PASSWORD_HASH_METHOD'] = '{method}'")
+
+@app.cli.command('precompress-assets')
+def precompress_assets_command():
+    """Write .gz/.br variants of the static and uploaded CSS/JS/SVG assets."""
+    written = precompress_directory(app.static_folder)
+    click.echo(f'{len(written)} precompressed files written')
+
+@app.cli.command('refresh-replica')
+def refresh_replica_command():
+    """Rebuild the SQLite read replica from the primary database."""
+    if not replica.refreshable:
+        raise click.ClickException('READ_REPLICA_URI is not a SQLite copy of the primary')
+    replica.refresh()
+    click.echo(f'Replica refreshed: {replica.engine.url.database}')
+
+@app.cli.command('rebuild-leaderboards')
+def rebuild_leaderboards_command():
+    """Recompute the current leaderboard periods from workout history."""
+    click.echo(f'{rebuild_leaderboards()} leaderboard rows written')
+
+@app.cli.command('replay-outbox')
+@click.option('--handler', default=None, help='Only replay the dead letters of this handler.')
+def replay_outbox_command(handler):
+    """Run dead-lettered outbox events through their handlers again."""
+    replayed, failed = outbox.replay(handler)
+    click.echo(f'{replayed} events replayed, {failed} still failing')
+
+@app.cli.command('archive-workouts')
+@click.option('--horizon-days', type=int, help='Defaults to ARCHIVE_HORIZON_DAYS.')
+def archive_workouts_command(horizon_days):
+    """Move old completed workouts into the archive table."""
+    click.echo(f'{archive_workouts(horizon_days)} workouts archived')
+
+@app.cli.command('reconcile-program-stats')
+def reconcile_program_stats_command():
+    """Rebuild the program popularity counters from the source tables."""
+    click.echo(f'{reconcile_program_stats()} programs reconciled')
+
+@app.cli.command('build-recommendations')
+def build_recommendations_command():
+    """Recompute the stored program and user recommendations."""
+    counts = build_recommendations()
+    click.echo(f"Recommendations for {counts['programs']} programs and {counts['users']} users")
+
 if __name__ == '__main__':
     with app.app_context():
         if not os.path.exists(app.config['UPLOAD_FOLDER']):
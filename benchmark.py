@@ -0,0 +1,329 @@
+"""Synthetic dataset generator and latency benchmark for the hot endpoints.
+
+    python benchmark.py generate --db bench.db --users 10000 --workouts 10000000 --programs 100000
+    python benchmark.py run --db bench.db --output baseline.json
+    python benchmark.py compare old.json new.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from werkzeug.security import generate_password_hash
+
+from app import (app, db, Achievement, CompletedWorkout, Goal, User, WorkoutProgram,
+                 add_sample_exercises, instrumentation, DIFFICULTY_TRANSLATIONS, EQUIPMENT_TRANSLATIONS,
+                 MUSCLE_GROUP_TRANSLATIONS, WORKOUT_INTENSITIES)
+from migrations import SCHEMA_UPDATES
+
+PROGRAM_TYPES = ['Strength', 'Hypertrophy', 'Endurance', 'Weight Loss', 'Cardio', 'Flexibility']
+CATEGORIES = ['strength', 'cardio', 'flexibility', 'hiit', 'general']
+GOAL_UNITS = ['kg', 'reps', 'sets', 'minutes', 'days']
+FREQUENCIES = ['daily', 'weekly', 'monthly', None]
+EXERCISE_NAMES = ['Bench Press', 'Squats', 'Deadlift', 'Pull-ups', 'Barbell Rows', 'Military Press',
+                  'Bicep Curls', 'Tricep Pushdowns', 'Lunges', 'Plank', 'Burpees', 'Dips',
+                  'Leg Press', 'Calf Raises', 'Lat Pulldown', 'Face Pulls', 'Hip Thrusts', 'Push-ups']
+ACHIEVEMENTS = [('Бірінші қадам', 'first-workout.svg'), ('Апта жауынгері', 'streak-7.svg'),
+                ('Жаттығу шебері', 'workout-master.svg'), ('Жаттығу фанаты', 'workout-100.svg')]
+
+ENDPOINTS = ['stats', 'programs', 'view_program', 'exercises', 'calendar', 'goals']
+
+CHUNK_SIZE = 50000
+
+
+def use_database(path):
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.abspath(path)
+
+
+def skewed_id(rng, count):
+    """Pick an id in 1..count with a long tail so a few rows are very heavy."""
+    return int(count * rng.random() ** 3) + 1
+
+
+def insert_rows(connection, model, columns, rows):
+    table = model.__table__.name
+    statement = f'INSERT INTO "{table}" ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+    cursor = connection.cursor()
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == CHUNK_SIZE:
+            cursor.executemany(statement, batch)
+            total += len(batch)
+            batch = []
+            print(f'  {table}: {total}', end='\r', flush=True)
+    if batch:
+        cursor.executemany(statement, batch)
+        total += len(batch)
+    connection.commit()
+    print(f'  {table}: {total}')
+
+
+def program_exercises(rng):
+    days = {}
+    for day in range(1, rng.randint(2, 6) + 1):
+        days[f'Күн {day}'] = [
+            {'name': name, 'sets': str(rng.randint(3, 5)), 'reps': f'{rng.randint(5, 8)}-{rng.randint(10, 15)}',
+             'rest': f'{rng.choice([45, 60, 90, 120])} сек'}
+            for name in rng.sample(EXERCISE_NAMES, rng.randint(3, 6))
+        ]
+    return json.dumps(days, ensure_ascii=False)
+
+
+def generate(args):
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    use_database(args.db)
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    password_hash = generate_password_hash('benchmark')
+
+    with app.app_context():
+        db.create_all()
+        add_sample_exercises()
+        connection = db.engine.raw_connection()
+        connection.execute('PRAGMA journal_mode=OFF')
+        connection.execute('PRAGMA synchronous=OFF')
+
+        print('Generating dataset')
+        insert_rows(connection, User, ['username', 'email', 'password_hash'], (
+            (f'user{i}', f'user{i}@bench.local', password_hash) for i in range(1, args.users + 1)
+        ))
+
+        muscle_groups = list(MUSCLE_GROUP_TRANSLATIONS)
+        equipment = list(EQUIPMENT_TRANSLATIONS)
+        levels = list(DIFFICULTY_TRANSLATIONS)
+        insert_rows(connection, WorkoutProgram, [
+            'title', 'description', 'exercises', 'category', 'difficulty', 'duration', 'is_public', 'user_id',
+            'target_muscle_groups', 'equipment_needed', 'workout_frequency', 'fitness_level', 'program_type',
+            'calories_burn'
+        ], ((
+            f'Program {i}', 'Synthetic benchmark program', program_exercises(rng), rng.choice(CATEGORIES),
+            rng.choice(levels), rng.choice([4, 6, 8, 12, 24]), rng.random() < 0.3, skewed_id(rng, args.users),
+            ', '.join(rng.sample(muscle_groups, 3)), ', '.join(rng.sample(equipment, 2)),
+            f'Аптасына {rng.randint(2, 6)} күн', rng.choice(levels), rng.choice(PROGRAM_TYPES),
+            rng.randint(200, 700)
+        ) for i in range(1, args.programs + 1)))
+
+        history_seconds = args.history_days * 86400
+        insert_rows(connection, CompletedWorkout, [
+            'date', 'notes', 'rating', 'duration', 'intensity', 'calories_burn', 'user_id', 'program_id'
+        ], ((
+            now - timedelta(seconds=rng.randrange(history_seconds)), None, rng.randint(1, 5),
+            rng.randint(20, 120), rng.choice(WORKOUT_INTENSITIES), rng.randint(150, 900),
+            skewed_id(rng, args.users), skewed_id(rng, args.programs)
+        ) for _ in range(args.workouts)))
+
+        insert_rows(connection, Goal, [
+            'title', 'description', 'target_date', 'is_completed', 'progress', 'user_id', 'category',
+            'target_value', 'current_value', 'unit', 'frequency', 'priority', 'created_at', 'version', 'is_overdue'
+        ], ((
+            f'Goal {i}', None, now + timedelta(days=rng.randint(-60, 180)), rng.random() < 0.3,
+            rng.randint(0, 100), skewed_id(rng, args.users), 'General', rng.randint(10, 500), rng.randint(0, 100),
+            rng.choice(GOAL_UNITS), rng.choice(FREQUENCIES), rng.randint(1, 5),
+            now - timedelta(days=rng.randint(0, args.history_days)), 1, False
+        ) for i in range(1, args.goals + 1)))
+
+        insert_rows(connection, Achievement, ['name', 'description', 'icon', 'user_id', 'date_earned'], (
+            (name, None, icon, user_id, now - timedelta(days=rng.randint(0, args.history_days)))
+            for user_id in range(1, args.users + 1)
+            for name, icon in ACHIEVEMENTS[:rng.randint(0, len(ACHIEVEMENTS))]
+        ))
+        # Raw inserts skip column defaults such as the sync timestamps
+        for statement in SCHEMA_UPDATES:
+            connection.execute(statement)
+        connection.commit()
+        connection.execute('ANALYZE')
+        connection.close()
+
+
+def dataset_summary():
+    return {model.__table__.name: model.query.count()
+            for model in (User, WorkoutProgram, CompletedWorkout, Goal, Achievement)}
+
+
+def pick_subjects(rng, count):
+    """Pick benchmark users, always including the heaviest one."""
+    heaviest = db.session.query(CompletedWorkout.user_id).group_by(CompletedWorkout.user_id).order_by(
+        db.func.count(CompletedWorkout.id).desc()).limit(1).scalar()
+    max_id = db.session.query(db.func.max(User.id)).scalar() or 1
+    users = [rng.randint(1, max_id) for _ in range(count - 1)]
+    return [heaviest or 1] + users
+
+
+def endpoint_url(name, rng, max_program_id):
+    if name == 'view_program':
+        return f'/view_program/{skewed_id(rng, max_program_id)}'
+    return f'/{name}'
+
+
+def login(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+
+def queries_since(before):
+    """Return the statements executed since a metrics snapshot."""
+    after = instrumentation.snapshot()
+    return sum(totals['queries'] for totals in after.values()) - \
+        sum(totals['queries'] for totals in before.values())
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def run(args):
+    use_database(args.db)
+    rng = random.Random(args.seed)
+    results = {}
+
+    with app.app_context():
+        summary = dataset_summary()
+        max_program_id = db.session.query(db.func.max(WorkoutProgram.id)).scalar() or 1
+        subjects = pick_subjects(rng, args.users)
+        client = app.test_client()
+
+        for name in args.endpoints:
+            latencies, queries, statuses = [], [], {}
+            for i in range(args.warmup + args.requests):
+                login(client, subjects[i % len(subjects)])
+                url = endpoint_url(name, rng, max_program_id)
+                before = instrumentation.snapshot()
+                start = perf_counter()
+                response = client.get(url)
+                elapsed = perf_counter() - start
+                if i < args.warmup:
+                    continue
+                latencies.append(elapsed * 1000)
+                queries.append(queries_since(before))
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                db.session.remove()
+
+            tracemalloc.start()
+            peak = 0
+            for i in range(args.memory_requests):
+                login(client, subjects[i % len(subjects)])
+                tracemalloc.reset_peak()
+                client.get(endpoint_url(name, rng, max_program_id))
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                db.session.remove()
+            tracemalloc.stop()
+
+            results[name] = {
+                'p50_ms': round(percentile(latencies, 50), 3),
+                'p95_ms': round(percentile(latencies, 95), 3),
+                'p99_ms': round(percentile(latencies, 99), 3),
+                'mean_ms': round(statistics.fmean(latencies), 3),
+                'queries_mean': round(statistics.fmean(queries), 2),
+                'queries_max': max(queries),
+                'peak_memory_kb': round(peak / 1024, 1),
+                'statuses': {str(code): count for code, count in sorted(statuses.items())}
+            }
+            print(f'{name:14} p50 {results[name]["p50_ms"]:9.2f} ms  p95 {results[name]["p95_ms"]:9.2f} ms  '
+                  f'p99 {results[name]["p99_ms"]:9.2f} ms  queries {results[name]["queries_max"]:4}  '
+                  f'peak {results[name]["peak_memory_kb"]:10.1f} KiB  {results[name]["statuses"]}')
+
+    baseline = {
+        'meta': {
+            'commit': git_commit(),
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'dataset': summary,
+            'requests': args.requests,
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        },
+        'endpoints': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    print(f'Baseline written to {args.output}')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f'{old["meta"].get("commit")} -> {new["meta"].get("commit")}')
+    regressions = []
+    for name, metrics in new['endpoints'].items():
+        previous = old['endpoints'].get(name)
+        if previous is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'queries_max', 'peak_memory_kb'):
+            before, after = previous[metric], metrics[metric]
+            change = (after - before) / before * 100 if before else 0.0
+            flag = ''
+            if change > args.threshold:
+                flag = '  REGRESSION'
+                regressions.append(f'{name}.{metric}')
+            print(f'{name:14} {metric:15} {before:12} -> {after:12}  {change:+7.1f}%{flag}')
+    if regressions:
+        print(f'{len(regressions)} metric(s) regressed more than {args.threshold}%')
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    gen = commands.add_parser('generate', help='Create a synthetic SQLite dataset.')
+    gen.add_argument('--db', default='bench.db')
+    gen.add_argument('--users', type=int, default=10000)
+    gen.add_argument('--programs', type=int, default=100000)
+    gen.add_argument('--workouts', type=int, default=10000000)
+    gen.add_argument('--goals', type=int, default=50000)
+    gen.add_argument('--history-days', type=int, default=3 * 365)
+    gen.add_argument('--seed', type=int, default=1)
+
+    bench = commands.add_parser('run', help='Drive the hot endpoints and write a baseline.')
+    bench.add_argument('--db', default='bench.db')
+    bench.add_argument('--endpoints', nargs='+', default=ENDPOINTS, choices=ENDPOINTS)
+    bench.add_argument('--requests', type=int, default=200)
+    bench.add_argument('--warmup', type=int, default=10)
+    bench.add_argument('--memory-requests', type=int, default=10)
+    bench.add_argument('--users', type=int, default=20, help='Distinct users to log in as.')
+    bench.add_argument('--seed', type=int, default=1)
+    bench.add_argument('--output', default='benchmark_baseline.json')
+
+    diff = commands.add_parser('compare', help='Diff two baselines.')
+    diff.add_argument('old')
+    diff.add_argument('new')
+    diff.add_argument('--threshold', type=float, default=10.0, help='Percent change reported as a regression.')
+
+    args = parser.parse_args(argv)
+    if args.command == 'generate':
+        generate(args)
+    elif args.command == 'run':
+        run(args)
+    else:
+        return compare(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
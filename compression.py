@@ -0,0 +1,206 @@
+import gzip
+import mimetypes
+import os
+import zlib
+
+from flask import request, send_from_directory
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:  # Optional; gzip is always available
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+    'text/calendar',
+    'text/css',
+    'text/csv',
+    'text/html',
+    'text/javascript',
+    'text/plain',
+    'text/xml',
+}
+
+# Extensions the precompress build step writes .gz/.br variants for
+PRECOMPRESS_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.html', '.txt')
+
+VARIANT_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def negotiate(accept_encoding):
+    """Pick 'br' or 'gzip' from an Accept-Encoding header, or None."""
+    if not accept_encoding:
+        return None
+    accept = parse_accept_header(accept_encoding)
+    choices = [('br', accept.quality('br'))] if brotli is not None else []
+    choices.append(('gzip', accept.quality('gzip')))
+    encoding, quality = max(choices, key=lambda choice: choice[1])
+    return encoding if quality > 0 else None
+
+
+class StreamCompressor:
+    """Incremental gzip or brotli encoder."""
+
+    def __init__(self, encoding, level):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=min(level, 11))
+        else:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+class CompressionMiddleware:
+    """WSGI middleware that compresses text responses, including streamed ones.
+
+    Bodies are encoded chunk by chunk as the application yields them, so
+    streamed exports never have to be buffered. Media types outside
+    COMPRESSIBLE_TYPES (jpg/png/mp4/webm uploads are already compressed),
+    responses that already have a Content-Encoding and bodies with a known
+    length below ``min_size`` pass through untouched.
+    """
+
+    def __init__(self, wsgi_app, min_size=500, level=6):
+        self.wsgi_app = wsgi_app
+        self.min_size = min_size
+        self.level = level
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate(environ.get('HTTP_ACCEPT_ENCODING'))
+        state = {'compressor': None}
+
+        def compressing_start_response(status, headers, exc_info=None):
+            headers = self._prepare(status, headers, encoding, environ, state)
+            return start_response(status, headers, exc_info)
+
+        body = self.wsgi_app(environ, compressing_start_response)
+        return self._iter_body(body, state)
+
+    def _prepare(self, status, headers, encoding, environ, state):
+        names = {name.lower(): value for name, value in headers}
+        mimetype = names.get('content-type', '').split(';')[0].strip().lower()
+        if mimetype not in COMPRESSIBLE_TYPES:
+            return headers
+
+        headers = [(name, value) for name, value in headers if name.lower() != 'vary'] + [
+            ('Vary', ', '.join(filter(None, [names.get('vary'), 'Accept-Encoding'])))]
+        length = names.get('content-length')
+        if (encoding is None
+                or environ.get('REQUEST_METHOD') == 'HEAD'
+                or not status.startswith('200')
+                or 'content-encoding' in names
+                or 'no-transform' in names.get('cache-control', '')
+                or (length is not None and int(length) < self.min_size)):
+            return headers
+
+        state['compressor'] = StreamCompressor(encoding, self.level)
+        prepared = []
+        for name, value in headers:
+            lowered = name.lower()
+            if lowered == 'content-length':
+                continue
+            if lowered == 'etag' and not value.startswith('W/'):
+                # The encoded body is a different representation of the same resource
+                value = 'W/' + value
+            prepared.append((name, value))
+        prepared.append(('Content-Encoding', encoding))
+        return prepared
+
+    def _iter_body(self, body, state):
+        try:
+            for chunk in body:
+                compressor = state['compressor']
+                if compressor is None:
+                    yield chunk
+                    continue
+                data = compressor.compress(chunk)
+                if data:
+                    yield data
+            if state['compressor'] is not None:
+                yield state['compressor'].finish()
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+
+def precompress_file(path, level=9):
+    """Write .gz (and .br when brotli is installed) next to ``path`` unless they are up to date."""
+    written = []
+    with open(path, 'rb') as source:
+        data = None
+        for encoding, suffix in VARIANT_SUFFIXES.items():
+            if encoding == 'br' and brotli is None:
+                continue
+            target = path + suffix
+            if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                continue
+            if data is None:
+                data = source.read()
+            if encoding == 'br':
+                encoded = brotli.compress(data, quality=11)
+            else:
+                encoded = gzip.compress(data, compresslevel=level, mtime=0)
+            if len(encoded) >= len(data):
+                continue
+            with open(target, 'wb') as output:
+                output.write(encoded)
+            written.append(target)
+    return written
+
+
+def precompress_directory(directory):
+    """Precompress every text asset below ``directory``; return the files written."""
+    written = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.endswith(PRECOMPRESS_EXTENSIONS):
+                written.extend(precompress_file(os.path.join(root, name)))
+    return written
+
+
+class Compress:
+    """Response compression plus static files served from their precompressed variants."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ENABLED', True)
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        self.app = app
+        if not app.config['COMPRESS_ENABLED']:
+            return
+        app.wsgi_app = CompressionMiddleware(app.wsgi_app, app.config['COMPRESS_MIN_SIZE'],
+                                             app.config['COMPRESS_LEVEL'])
+        if 'static' in app.view_functions:
+            app.view_functions['static'] = self.send_static_file
+
+    def send_static_file(self, filename):
+        """Serve ``filename.br``/``filename.gz`` when the client accepts it and the variant exists."""
+        static_folder = self.app.static_folder
+        encoding = negotiate(request.headers.get('Accept-Encoding'))
+        suffix = VARIANT_SUFFIXES.get(encoding)
+        if suffix is not None and filename.endswith(PRECOMPRESS_EXTENSIONS):
+            candidate = os.path.join(static_folder, filename + suffix)
+            if os.path.isfile(candidate):
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                response = send_from_directory(static_folder, filename + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                response.vary.add('Accept-Encoding')
+                return response
+        return self.app.send_static_file(filename)
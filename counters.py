@@ -0,0 +1,36 @@
+import threading
+from collections import Counter, defaultdict
+
+
+class CounterBuffer:
+    """Thread-safe in-process accumulator of counter deltas keyed by row id.
+
+    Requests add deltas in memory and a periodic job drains them into one
+    upsert per key, so a hot row is written once per flush instead of once
+    per event. Deltas still buffered when the process dies are lost; the
+    reconcile job rebuilds the counters from their source tables.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(Counter)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def add(self, key, **deltas):
+        with self._lock:
+            self._pending[key].update(deltas)
+
+    def drain(self):
+        """Return the pending deltas and start a new, empty buffer."""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(Counter)
+        return pending
+
+    def restore(self, pending):
+        """Put drained deltas back after a failed flush."""
+        with self._lock:
+            for key, deltas in pending.items():
+                self._pending[key].update(deltas)
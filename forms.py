@@ -65,6 +65,7 @@ class GoalForm(FlaskForm):
                           ('reps', 'Қайталау'),
                           ('sets', 'Сет'),
                           ('minutes', 'Минут'),
+                          ('sessions', 'Жаттығу'),
                           ('days', 'Күн')
                       ])
 
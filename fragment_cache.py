@@ -0,0 +1,120 @@
+import os
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+
+
+class TTLLRUCache:
+    """Thread-safe LRU mapping whose entries also expire after a per-entry TTL."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class FragmentCacheExtension(Extension):
+    """``{% cache key, ttl %}...{% endcache %}`` stores the rendered block in ``environment.fragment_cache``.
+
+    The key must capture everything the block depends on; build it with
+    ``fragment_key(program, ...)`` so it changes whenever the rows do. The
+    TTL is optional and defaults to ``environment.fragment_cache_timeout``.
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=TTLLRUCache(), fragment_cache_timeout=300)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache_support', args), [], [], body).set_lineno(lineno)
+
+    def _cache_support(self, key, ttl, caller):
+        cache = self.environment.fragment_cache
+        value = cache.get(key)
+        if value is None:
+            value = caller()
+            cache.set(key, value, ttl or self.environment.fragment_cache_timeout)
+        return value
+
+
+def fragment_key(*parts):
+    """Build a fragment cache key; model instances contribute their table, id and updated_at."""
+    key = []
+    for part in parts:
+        if hasattr(part, '__tablename__'):
+            updated_at = getattr(part, 'updated_at', None)
+            key.append(f'{part.__tablename__}:{part.id}:{updated_at.timestamp() if updated_at else 0}')
+        else:
+            key.append(str(part))
+    return '|'.join(key)
+
+
+class TemplateCache:
+    """Jinja bytecode cache on disk plus the in-process ``{% cache %}`` fragment cache."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JINJA_BYTECODE_CACHE_DIR', None)
+        app.config.setdefault('FRAGMENT_CACHE_SIZE', 1024)
+        app.config.setdefault('FRAGMENT_CACHE_TIMEOUT', 300)
+
+        # Compiled templates are shared by every worker, so new ones skip compilation.
+        # Bytecode is unmarshalled on load, so the directory must not be writable by
+        # other users: None picks Jinja's per-user directory (mode 0700, owner checked)
+        # and False turns the cache off.
+        directory = app.config['JINJA_BYTECODE_CACHE_DIR']
+        if directory is None:
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+        elif directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.fragment_cache = TTLLRUCache(app.config['FRAGMENT_CACHE_SIZE'])
+        app.jinja_env.fragment_cache_timeout = app.config['FRAGMENT_CACHE_TIMEOUT']
+        app.jinja_env.globals['fragment_key'] = fragment_key
+        self.cache = app.jinja_env.fragment_cache
+
+    def clear(self):
+        self.cache.clear()
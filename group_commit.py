@@ -0,0 +1,140 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from flask import has_request_context
+from werkzeug.exceptions import ServiceUnavailable
+
+
+class WriteIntent:
+    """A write submitted to the group committer and the future its caller waits on."""
+
+    __slots__ = ('func', 'args', 'kwargs', 'future')
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+
+
+class GroupCommitter:
+    """Coalesces write intents from request threads into shared transactions.
+
+    SQLite allows one writer and every commit pays for an fsync, so
+    concurrent handlers that each commit queue up behind one another. A
+    single writer thread instead takes every intent that arrives within
+    ``GROUP_COMMIT_WINDOW_MS`` (up to ``GROUP_COMMIT_MAX_BATCH``), runs each
+    one in its own savepoint and commits them together. An intent that
+    raises is rolled back to its savepoint and only its caller sees the
+    error. Intents run without a request context, so they take plain ids
+    and return plain values rather than ORM objects.
+
+    With ``GROUP_COMMIT_ENABLED`` off, :meth:`run` executes the intent on the
+    calling thread and commits it on its own.
+    """
+
+    def __init__(self, app=None, db=None):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('GROUP_COMMIT_ENABLED', True)
+        app.config.setdefault('GROUP_COMMIT_WINDOW_MS', 2)
+        app.config.setdefault('GROUP_COMMIT_MAX_BATCH', 64)
+        app.config.setdefault('GROUP_COMMIT_TIMEOUT', 10)
+        self.app = app
+        self.db = db
+
+    @property
+    def pending(self):
+        """Intents waiting for the writer thread."""
+        return self._queue.qsize()
+
+    def run(self, func, *args, **kwargs):
+        """Execute ``func(*args, **kwargs)`` in a group commit and return its result once durable."""
+        db = self.db
+        if not self.app.config['GROUP_COMMIT_ENABLED']:
+            result = func(*args, **kwargs)
+            db.session.commit()
+            return result
+
+        # End this request's transaction so it holds no SQLite lock the writer needs
+        db.session.commit()
+        intent = WriteIntent(func, args, kwargs)
+        self._ensure_thread()
+        self._queue.put(intent)
+        try:
+            result = intent.future.result(timeout=self.app.config['GROUP_COMMIT_TIMEOUT'])
+        except FutureTimeout:
+            if intent.future.cancel():
+                raise ServiceUnavailable(retry_after=1)
+            # Already in a batch; its outcome is moments away
+            result = intent.future.result()
+        if has_request_context():
+            # The rows were written on the writer's connection; keep this request on the primary
+            db.session().wrote = True
+        return result
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._writer, name='group-commit', daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        """Block for one intent, then gather whatever else arrives within the window."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.app.config['GROUP_COMMIT_WINDOW_MS'] / 1000.0
+        while len(batch) < self.app.config['GROUP_COMMIT_MAX_BATCH']:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _writer(self):
+        while True:
+            batch = self._collect()
+            with self.app.app_context():
+                try:
+                    self._commit(batch)
+                except Exception as e:
+                    self.app.logger.exception('Group commit of %d intents failed', len(batch))
+                    for intent in batch:
+                        if not intent.future.done():
+                            intent.future.set_exception(e)
+                finally:
+                    self.db.session.remove()
+
+    def _commit(self, batch):
+        session = self.db.session
+        if self.db.engine.dialect.name == 'sqlite':
+            # Take the write lock up front; without an outer transaction the
+            # first RELEASE SAVEPOINT would commit on its own
+            session.execute(self.db.text('BEGIN IMMEDIATE'))
+        results = []
+        for intent in batch:
+            if not intent.future.set_running_or_notify_cancel():
+                continue
+            savepoint = session.begin_nested()
+            try:
+                result = intent.func(*intent.args, **intent.kwargs)
+                savepoint.commit()
+            except Exception as e:
+                savepoint.rollback()
+                intent.future.set_exception(e)
+                continue
+            results.append((intent, result))
+        session.commit()
+        for intent, result in results:
+            intent.future.set_result(result)
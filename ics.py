@@ -0,0 +1,57 @@
+"""Minimal iCalendar (RFC 5545) writer that yields the feed line by line."""
+from datetime import datetime
+
+PRODUCT_ID = '-//Fitness App//Workouts//KK'
+
+
+def escape(text):
+    return (text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def format_datetime(moment):
+    """Format a naive UTC datetime."""
+    return moment.strftime('%Y%m%dT%H%M%SZ')
+
+
+def content_line(name, value):
+    """Return one CRLF-terminated line, folded at 75 octets."""
+    data = f'{name}:{value}'.encode('utf-8')
+    parts = []
+    while len(data) > 75:
+        cut = 75 if not parts else 74
+        # Never split a multi-byte UTF-8 sequence
+        while cut and (data[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(data[:cut])
+        data = data[cut:]
+    parts.append(data)
+    return b'\r\n '.join(parts).decode('utf-8') + '\r\n'
+
+
+def iter_calendar(events, name=None):
+    """Yield the lines of a VCALENDAR for an iterable of event dicts.
+
+    Events need ``uid``, ``start`` and ``end``; ``summary`` and
+    ``description`` are optional. Nothing is buffered, so large histories can
+    be streamed straight into the response.
+    """
+    stamp = format_datetime(datetime.utcnow())
+    yield content_line('BEGIN', 'VCALENDAR')
+    yield content_line('VERSION', '2.0')
+    yield content_line('PRODID', PRODUCT_ID)
+    yield content_line('CALSCALE', 'GREGORIAN')
+    if name:
+        yield content_line('X-WR-CALNAME', escape(name))
+    for event in events:
+        yield content_line('BEGIN', 'VEVENT')
+        yield content_line('UID', event['uid'])
+        yield content_line('DTSTAMP', stamp)
+        yield content_line('DTSTART', format_datetime(event['start']))
+        yield content_line('DTEND', format_datetime(event['end']))
+        if event.get('summary'):
+            yield content_line('SUMMARY', escape(event['summary']))
+        if event.get('description'):
+            yield content_line('DESCRIPTION', escape(event['description']))
+        yield content_line('END', 'VEVENT')
+    yield content_line('END', 'VCALENDAR')
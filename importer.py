@@ -0,0 +1,133 @@
+import csv
+import io
+import json
+import math
+from datetime import datetime
+from itertools import islice
+
+SUPPORTED_FORMATS = ('csv', 'jsonl')
+
+DATETIME_FORMATS = ('%Y-%m-%d %H:%M', '%d.%m.%Y', '%d.%m.%Y %H:%M', '%m/%d/%Y')
+
+
+class ImportRowError(ValueError):
+    """Raised when a single imported row cannot be mapped."""
+
+
+def detect_format(filename, default=None):
+    """Guess the import format from a file name."""
+    if filename and '.' in filename:
+        extension = filename.rsplit('.', 1)[1].lower()
+        if extension == 'csv':
+            return 'csv'
+        if extension in ('jsonl', 'ndjson', 'json'):
+            return 'jsonl'
+    return default
+
+
+def iter_records(stream, fmt):
+    """Yield (line number, record) pairs from a binary stream without reading it whole.
+
+    Malformed JSON lines are yielded with a ``None`` record so the caller can
+    count them as skipped rows instead of aborting the import.
+    """
+    if fmt not in SUPPORTED_FORMATS:
+        raise ValueError(f'Unsupported import format: {fmt}')
+
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    for line_no, line in enumerate(text, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_no, record if isinstance(record, dict) else None
+
+
+def chunked(iterable, size):
+    """Split an iterable into lists of at most ``size`` items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def clean(value):
+    """Normalize an empty CSV/JSON cell to None."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+def parse_datetime(value, field):
+    value = clean(value)
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        try:
+            return datetime.utcfromtimestamp(value)
+        except (OverflowError, OSError, ValueError):
+            raise ImportRowError(f'{field}: жарамсыз күн "{value}"')
+    text = str(value)
+    if text.endswith('Z'):
+        text = text[:-1]
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        pass
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    raise ImportRowError(f'{field}: жарамсыз күн "{value}"')
+
+
+def parse_int(value, field, minimum=None, maximum=None):
+    value = clean(value)
+    if value is None:
+        return None
+    try:
+        number = int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        raise ImportRowError(f'{field}: сан емес "{value}"')
+    if (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+        raise ImportRowError(f'{field}: {number} рұқсат етілген аралықтан тыс')
+    return number
+
+
+def parse_float(value, field, minimum=None):
+    value = clean(value)
+    if value is None:
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ImportRowError(f'{field}: сан емес "{value}"')
+    if not math.isfinite(number):
+        raise ImportRowError(f'{field}: сан емес "{value}"')
+    if minimum is not None and number < minimum:
+        raise ImportRowError(f'{field}: {number} рұқсат етілген аралықтан тыс')
+    return number
+
+
+def parse_bool(value):
+    value = clean(value)
+    if isinstance(value, bool):
+        return value
+    if value is None:
+        return False
+    return str(value).lower() in ('1', 'true', 'yes', 'y', 'иә')
@@ -0,0 +1,244 @@
+import hmac
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+from flask import Response, abort, g, has_app_context, has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    """Timings collected for the request being served."""
+
+    __slots__ = ('start', 'queries', 'db_time', 'render_time')
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+
+
+class EndpointStats:
+    """Running totals for one endpoint/method pair."""
+
+    __slots__ = ('requests', 'queries', 'db_time', 'render_time', 'latency', 'buckets')
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.latency = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+
+class QueryCapture:
+    """Statements executed on the current thread while the capture is active."""
+
+    def __init__(self):
+        self.statements = []
+
+    def __len__(self):
+        return len(self.statements)
+
+    def __enter__(self):
+        _captures().append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _captures().remove(self)
+        return False
+
+
+_local = threading.local()
+
+
+def _captures():
+    if not hasattr(_local, 'captures'):
+        _local.captures = []
+    return _local.captures
+
+
+def capture_queries():
+    """Record every SQL statement (with parameters) executed by this thread."""
+    return QueryCapture()
+
+
+def current_stats():
+    """Return the RequestStats of the active request, if it is instrumented."""
+    if has_app_context():
+        return g.get('request_stats')
+    return None
+
+
+class TimedTemplate(Template):
+    """Jinja template that adds its render time to the request stats."""
+
+    def render(self, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            stats = current_stats()
+            if stats is not None:
+                stats.render_time += perf_counter() - start
+
+
+class Instrumentation:
+    """Per-endpoint query counts, DB/render/total timings and a slow query log.
+
+    Totals are kept per process; with several gunicorn workers each worker
+    exposes its own series and Prometheus sums them. ``/metrics`` answers
+    requests from ``METRICS_ALLOWED_IPS`` and requests carrying
+    ``Authorization: Bearer <METRICS_TOKEN>``; everyone else gets a 404.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._gauges = []
+        self.logger = None
+        self.slow_query_threshold = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SLOW_QUERY_THRESHOLD_MS', 100)
+        app.config.setdefault('SERVER_TIMING_HEADER', True)
+        app.config.setdefault('METRICS_TOKEN', None)
+        app.config.setdefault('METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+        self.app = app
+        self.logger = app.logger
+        self.slow_query_threshold = app.config['SLOW_QUERY_THRESHOLD_MS'] / 1000.0
+        self.server_timing = app.config['SERVER_TIMING_HEADER']
+
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.jinja_env.template_class = TimedTemplate
+        app.add_url_rule('/metrics', 'metrics', self.metrics)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - conn.info['query_start'].pop()
+        stats = current_stats()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+        for capture in _captures():
+            capture.statements.append((statement, parameters))
+        if elapsed >= self.slow_query_threshold:
+            endpoint = request.endpoint if has_request_context() else None
+            self.logger.warning('Slow query %.1f ms (%s): %s; parameters=%r',
+                                elapsed * 1000, endpoint or '-', statement, parameters)
+
+    def _before_request(self):
+        g.request_stats = RequestStats()
+
+    def _after_request(self, response):
+        stats = g.pop('request_stats', None)
+        if stats is None:
+            return response
+        total = perf_counter() - stats.start
+        self.record(request.endpoint or 'unknown', request.method, stats, total)
+
+        if self.server_timing:
+            response.headers.add('Server-Timing', ', '.join([
+                f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries"',
+                f'render;dur={stats.render_time * 1000:.2f}',
+                f'total;dur={total * 1000:.2f}'
+            ]))
+        return response
+
+    def record(self, endpoint, method, stats, total):
+        with self._lock:
+            totals = self._endpoints.get((endpoint, method))
+            if totals is None:
+                totals = self._endpoints[(endpoint, method)] = EndpointStats()
+            totals.requests += 1
+            totals.queries += stats.queries
+            totals.db_time += stats.db_time
+            totals.render_time += stats.render_time
+            totals.latency += total
+            totals.buckets[bisect_left(LATENCY_BUCKETS, total)] += 1
+
+    def snapshot(self):
+        """Return a copy of the per-endpoint totals keyed by (endpoint, method)."""
+        with self._lock:
+            return {key: {
+                'requests': totals.requests,
+                'queries': totals.queries,
+                'db_time': totals.db_time,
+                'render_time': totals.render_time,
+                'latency': totals.latency
+            } for key, totals in self._endpoints.items()}
+
+    def gauge(self, name, help_text, callback, label=None):
+        """Expose ``callback()`` as a gauge on /metrics.
+
+        With ``label`` the callback returns a mapping of label value to number.
+        """
+        self._gauges.append((name, help_text, callback, label))
+
+    def _scraper_allowed(self):
+        token = self.app.config['METRICS_TOKEN']
+        if token:
+            scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+            if scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), token.encode()):
+                return True
+        return request.remote_addr in self.app.config['METRICS_ALLOWED_IPS']
+
+    def metrics(self):
+        """Expose the totals in the Prometheus text format."""
+        if not self._scraper_allowed():
+            abort(404)
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            lines = []
+
+            def series(name, kind, help_text, value_of):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for (endpoint, method), totals in endpoints:
+                    lines.append(f'{name}{{endpoint="{endpoint}",method="{method}"}} {value_of(totals)}')
+
+            series('fitness_http_requests_total', 'counter', 'Requests served.',
+                   lambda t: t.requests)
+            series('fitness_db_queries_total', 'counter', 'SQL statements executed while serving requests.',
+                   lambda t: t.queries)
+            series('fitness_db_seconds_total', 'counter', 'Time spent executing SQL.',
+                   lambda t: f'{t.db_time:.6f}')
+            series('fitness_render_seconds_total', 'counter', 'Time spent rendering templates.',
+                   lambda t: f'{t.render_time:.6f}')
+
+            name = 'fitness_http_request_duration_seconds'
+            lines.append(f'# HELP {name} Total request latency.')
+            lines.append(f'# TYPE {name} histogram')
+            for (endpoint, method), totals in endpoints:
+                labels = f'endpoint="{endpoint}",method="{method}"'
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), totals.buckets):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{labels}}} {totals.latency:.6f}')
+                lines.append(f'{name}_count{{{labels}}} {totals.requests}')
+
+        for name, help_text, callback, label in self._gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            if label is None:
+                lines.append(f'{name} {callback()}')
+            else:
+                for value, number in sorted(callback().items()):
+                    lines.append(f'{name}{{{label}="{value}"}} {number}')
+
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
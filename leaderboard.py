@@ -0,0 +1,197 @@
+import random
+import threading
+
+MAX_LEVEL = 32
+
+
+class _Node:
+    __slots__ = ('key', 'forward', 'span')
+
+    def __init__(self, key, level):
+        self.key = key
+        self.forward = [None] * level
+        self.span = [0] * level
+
+
+class IndexableSkipList:
+    """Sorted keys with O(log n) insert, remove, rank and lookup by rank.
+
+    Each forward link stores how many level-0 steps it skips, so the rank
+    of a key is the sum of the spans walked to reach it.
+    """
+
+    def __init__(self, seed=None):
+        self._head = _Node(None, MAX_LEVEL)
+        self._level = 1
+        self._size = 0
+        self._random = random.Random(seed)
+
+    def __len__(self):
+        return self._size
+
+    def _random_level(self):
+        level = 1
+        while level < MAX_LEVEL and self._random.random() < 0.5:
+            level += 1
+        return level
+
+    def _path(self, key):
+        """Last node before ``key`` on every level, and the rank of each of those nodes."""
+        update = [self._head] * MAX_LEVEL
+        rank = [0] * MAX_LEVEL
+        node = self._head
+        for i in reversed(range(self._level)):
+            rank[i] = rank[i + 1] if i + 1 < self._level else 0
+            while node.forward[i] is not None and node.forward[i].key < key:
+                rank[i] += node.span[i]
+                node = node.forward[i]
+            update[i] = node
+        return update, rank
+
+    def insert(self, key):
+        update, rank = self._path(key)
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                rank[i] = 0
+                update[i] = self._head
+                self._head.span[i] = self._size
+            self._level = level
+
+        node = _Node(key, level)
+        for i in range(level):
+            node.forward[i] = update[i].forward[i]
+            update[i].forward[i] = node
+            node.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = rank[0] - rank[i] + 1
+        for i in range(level, self._level):
+            update[i].span[i] += 1
+        self._size += 1
+
+    def remove(self, key):
+        """Remove ``key``; returns False if it was not present."""
+        update, _ = self._path(key)
+        node = update[0].forward[0]
+        if node is None or node.key != key:
+            return False
+        for i in range(self._level):
+            if update[i].forward[i] is node:
+                update[i].span[i] += node.span[i] - 1
+                update[i].forward[i] = node.forward[i]
+            else:
+                update[i].span[i] -= 1
+        while self._level > 1 and self._head.forward[self._level - 1] is None:
+            self._level -= 1
+        self._size -= 1
+        return True
+
+    def rank(self, key):
+        """1-based position of ``key``, or None if it is not present."""
+        rank = 0
+        node = self._head
+        for i in reversed(range(self._level)):
+            while node.forward[i] is not None and node.forward[i].key <= key:
+                rank += node.span[i]
+                node = node.forward[i]
+            if node is not self._head and node.key == key:
+                return rank
+        return None
+
+    def iter_from(self, rank):
+        """Yield the keys from 1-based position ``rank`` onwards."""
+        traversed = 0
+        node = self._head
+        for i in reversed(range(self._level)):
+            while node.forward[i] is not None and traversed + node.span[i] < rank:
+                traversed += node.span[i]
+                node = node.forward[i]
+        node = node.forward[0]
+        while node is not None:
+            yield node.key
+            node = node.forward[0]
+
+
+class Leaderboard:
+    """Members ranked by score, highest first; ties go to the lower member id.
+
+    Members with a score of zero or less are left off the board.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scores = {}
+        self._order = IndexableSkipList()
+
+    def __len__(self):
+        return len(self._scores)
+
+    def set(self, member, score):
+        with self._lock:
+            old = self._scores.pop(member, None)
+            if old is not None:
+                self._order.remove((-old, member))
+            if score > 0:
+                self._scores[member] = score
+                self._order.insert((-score, member))
+
+    def score(self, member):
+        return self._scores.get(member)
+
+    def rank(self, member):
+        """Return (1-based rank, score) of ``member``, or None when it is not ranked."""
+        with self._lock:
+            score = self._scores.get(member)
+            if score is None:
+                return None
+            return self._order.rank((-score, member)), score
+
+    def top(self, count, offset=0):
+        """Return up to ``count`` (member, score) pairs starting after ``offset`` ranks."""
+        with self._lock:
+            entries = []
+            for negative_score, member in self._order.iter_from(offset + 1):
+                if len(entries) >= count:
+                    break
+                entries.append((member, -negative_score))
+            return entries
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+            self._order = IndexableSkipList()
+
+
+class LeaderboardSet:
+    """One :class:`Leaderboard` per (window, metric), each tied to the window's current period.
+
+    The rank table is the source of truth; the boards are a per-process
+    index over its rows for the current periods.
+    """
+
+    def __init__(self, windows, metrics):
+        self._lock = threading.Lock()
+        self.windows = tuple(windows)
+        self.metrics = tuple(metrics)
+        self.periods = {}
+        self.synced_at = None
+        self._boards = {(window, metric): Leaderboard() for window in self.windows for metric in self.metrics}
+
+    def board(self, window, metric):
+        return self._boards[(window, metric)]
+
+    def start_period(self, window, period):
+        """Empty the window's boards if ``period`` is not the one they hold; returns True if it was new."""
+        with self._lock:
+            if self.periods.get(window) == period:
+                return False
+            for metric in self.metrics:
+                self._boards[(window, metric)].clear()
+            self.periods[window] = period
+            return True
+
+    def apply(self, window, period, member, scores):
+        """Set ``member``'s scores on the window's boards if ``period`` is the one they hold."""
+        if self.periods.get(window) != period:
+            return
+        for metric in self.metrics:
+            self._boards[(window, metric)].set(member, scores[metric])
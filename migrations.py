@@ -1,10 +1,84 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy import inspect
 from app import app, db, Exercise
 
 migrate = Migrate(app, db)
 
+# Columns added to existing tables; db.create_all() only creates missing tables
+SCHEMA_COLUMNS = [
+    ('completed_workout', 'duration', 'INTEGER'),
+    ('completed_workout', 'intensity', 'VARCHAR(20)'),
+    ('completed_workout', 'calories_burn', 'INTEGER'),
+    ('goal', 'created_at', 'DATETIME'),
+    ('goal', 'version', 'INTEGER NOT NULL DEFAULT 1'),
+    ('goal', 'period_start', 'DATETIME'),
+    ('goal', 'is_overdue', 'BOOLEAN NOT NULL DEFAULT 0'),
+    ('goal', 'reminded_at', 'DATETIME'),
+    ('workout_program', 'updated_at', 'DATETIME'),
+    ('completed_workout', 'updated_at', 'DATETIME'),
+    ('goal', 'updated_at', 'DATETIME'),
+    ('achievement', 'updated_at', 'DATETIME'),
+    ('exercise', 'updated_at', 'DATETIME'),
+    ('outbox_cursor', 'attempts', 'INTEGER NOT NULL DEFAULT 0'),
+    ('outbox_cursor', 'retry_at', 'DATETIME'),
+    ('outbox_cursor', 'last_error', 'TEXT'),
+]
+
+# The current time in the format SQLAlchemy stores DateTime columns in on SQLite. CURRENT_TIMESTAMP
+# has no fraction, and '... 10:00:00' sorts before '... 10:00:00.000000', which breaks keyset cursors
+NOW = "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+# Columns that earlier upgrades filled with CURRENT_TIMESTAMP
+SECONDS_TIMESTAMPS = [
+    ('workout_program', 'updated_at'),
+    ('goal', 'updated_at'),
+    ('exercise', 'updated_at'),
+    ('program_share', 'created_at'),
+    ('program_save', 'created_at'),
+]
+
+# Backfills for rows written before a column existed or by raw inserts that skip column defaults
+SCHEMA_UPDATES = [
+    f'UPDATE workout_program SET updated_at = {NOW} WHERE updated_at IS NULL',
+    'UPDATE completed_workout SET updated_at = date WHERE updated_at IS NULL',
+    f'UPDATE goal SET updated_at = COALESCE(created_at, {NOW}) WHERE updated_at IS NULL',
+    'UPDATE achievement SET updated_at = date_earned WHERE updated_at IS NULL',
+    f'UPDATE exercise SET updated_at = {NOW} WHERE updated_at IS NULL',
+] + [
+    f"UPDATE {table} SET {column} = {column} || '.000000' WHERE length({column}) = 19"
+    for table, column in SECONDS_TIMESTAMPS
+]
+
+SCHEMA_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS ix_completed_workout_user_date ON completed_workout (user_id, date)',
+    'CREATE INDEX IF NOT EXISTS ix_goal_user_completed ON goal (user_id, is_completed)',
+    'DROP INDEX IF EXISTS ix_goal_completed_target_date',
+    'CREATE INDEX IF NOT EXISTS ix_goal_completed_overdue_target_date ON goal (is_completed, is_overdue, target_date)',
+    'CREATE INDEX IF NOT EXISTS ix_goal_frequency_period_start ON goal (frequency, period_start)',
+    'CREATE INDEX IF NOT EXISTS ix_workout_program_updated ON workout_program (updated_at)',
+    'CREATE INDEX IF NOT EXISTS ix_workout_program_user_updated ON workout_program (user_id, updated_at)',
+    'CREATE INDEX IF NOT EXISTS ix_completed_workout_user_updated ON completed_workout (user_id, updated_at)',
+    'CREATE INDEX IF NOT EXISTS ix_goal_user_updated ON goal (user_id, updated_at)',
+    'CREATE INDEX IF NOT EXISTS ix_achievement_user_updated ON achievement (user_id, updated_at)',
+    'CREATE INDEX IF NOT EXISTS ix_completed_workout_date ON completed_workout (date)',
+]
+
+# Rows copied into a table when upgrade_schema() creates it. Shares and saves used to
+# live together in program_shares, and both the saved and the shared lists showed every
+# row, so each legacy row goes into both tables to keep both lists as users knew them
+SCHEMA_BACKFILLS = {
+    'program_share': ('program_shares', f'''
+        INSERT OR IGNORE INTO program_share (program_id, user_id, created_at)
+        SELECT program_id, user_id, {NOW} FROM program_shares
+    '''),
+    'program_save': ('program_shares', f'''
+        INSERT OR IGNORE INTO program_save (program_id, user_id, created_at)
+        SELECT program_id, user_id, {NOW} FROM program_shares
+    '''),
+}
+
 def upgrade():
     # Add Kazakh translation columns
     with app.app_context():
@@ -78,5 +152,25 @@ def downgrade():
             DROP COLUMN instructions_kz
         ''')
 
+def upgrade_schema():
+    # Add missing columns, tables and indexes to an existing database
+    with app.app_context():
+        inspector = inspect(db.engine)
+        tables = inspector.get_table_names()
+        for table, column, ddl in SCHEMA_COLUMNS:
+            if table not in tables:
+                continue
+            if column not in {c['name'] for c in inspector.get_columns(table)}:
+                db.engine.execute(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}')
+        
+        db.create_all()
+        for table, (source, statement) in SCHEMA_BACKFILLS.items():
+            if table not in tables and source in tables:
+                db.engine.execute(statement)
+        for statement in SCHEMA_UPDATES:
+            db.engine.execute(statement)
+        for statement in SCHEMA_INDEXES:
+            db.engine.execute(statement)
+
 if __name__ == '__main__':
-    upgrade() 
\ No newline at end of file
+    upgrade_schema() 
\ No newline at end of file
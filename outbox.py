@@ -0,0 +1,265 @@
+import json
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+
+class Outbox:
+    """Transactional outbox with an in-process dispatcher.
+
+    ``publish`` adds an event row to the caller's session, so the event
+    commits or rolls back with the change it describes. A dispatcher thread,
+    woken by the commit and polling every ``OUTBOX_POLL_SECONDS`` for events
+    written by other processes, reads up to ``OUTBOX_BATCH_SIZE`` events and
+    hands them to every registered handler in one write transaction, each
+    handler in its own savepoint. The handlers' writes and the advance of
+    their cursors commit together, and the transaction holds the write lock,
+    so dispatchers in other workers cannot apply a batch twice.
+
+    Delivery is at least once. When a handler raises, its batch is retried
+    one event at a time to find the failing event; the handler's cursor
+    stops in front of it and retries back off from ``OUTBOX_RETRY_SECONDS``.
+    After ``OUTBOX_MAX_ATTEMPTS`` failures the event is copied to the dead
+    letter table and the handler moves on; :meth:`replay` runs the handler
+    on dead letters again once the cause is fixed.
+    """
+
+    def __init__(self, app=None, db=None, event_model=None, cursor_model=None, dead_letter_model=None):
+        self._handlers = []
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, db, event_model, cursor_model, dead_letter_model)
+
+    def init_app(self, app, db, event_model, cursor_model, dead_letter_model):
+        app.config.setdefault('OUTBOX_BATCH_SIZE', 200)
+        app.config.setdefault('OUTBOX_POLL_SECONDS', 1.0)
+        app.config.setdefault('OUTBOX_RETENTION_HOURS', 24)
+        app.config.setdefault('OUTBOX_MAX_ATTEMPTS', 5)
+        app.config.setdefault('OUTBOX_RETRY_SECONDS', 5)
+        self.app = app
+        self.db = db
+        self.event_model = event_model
+        self.cursor_model = cursor_model
+        self.dead_letter_model = dead_letter_model
+
+    def handler(self, *event_types):
+        """Register the decorated function for ``event_types``; it is called with a list of event rows."""
+        def register(func):
+            self._handlers.append((func.__name__, event_types, func))
+            return func
+        return register
+
+    def publish(self, event_type, **payload):
+        """Add an event to the current transaction."""
+        session = self.db.session()
+        session.add(self.event_model(type=event_type, payload=json.dumps(payload), created_at=datetime.utcnow()))
+        event.listen(session, 'after_commit', self._notify, once=True)
+
+    def _notify(self, session):
+        self._ensure_thread()
+        self._wake.set()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._dispatcher, name='outbox', daemon=True)
+                self._thread.start()
+
+    def _dispatcher(self):
+        while True:
+            self._wake.wait(timeout=self.app.config['OUTBOX_POLL_SECONDS'])
+            self._wake.clear()
+            with self.app.app_context():
+                try:
+                    self.dispatch()
+                except Exception:
+                    self.db.session.rollback()
+                    self.app.logger.exception('Outbox dispatch failed')
+                finally:
+                    self.db.session.remove()
+
+    def dispatch(self):
+        """Deliver every pending event to its handlers; returns the number of events read."""
+        delivered = 0
+        while True:
+            count, more = self._dispatch_batch()
+            delivered += count
+            if not more:
+                return delivered
+
+    def _ready(self, position, retry_at, high, now):
+        return position < high and (retry_at is None or retry_at <= now)
+
+    def _dispatch_batch(self):
+        """Run one batch through every handler that is behind; returns (events read, whether more are pending)."""
+        db, Event, Cursor = self.db, self.event_model, self.cursor_model
+        batch_size = self.app.config['OUTBOX_BATCH_SIZE']
+        now = datetime.utcnow()
+        high = db.session.query(db.func.max(Event.id)).scalar() or 0
+        # Read without the write lock first so an idle pass costs no write transaction
+        state = {handler: (position, retry_at) for handler, position, retry_at in
+                 db.session.query(Cursor.handler, Cursor.position, Cursor.retry_at)}
+        if not any(self._ready(*state.get(name, (0, None)), high, now) for name, _, _ in self._handlers):
+            db.session.rollback()
+            return 0, False
+
+        self._begin()
+        cursors = {cursor.handler: cursor for cursor in Cursor.query.with_for_update()}
+        ready = []
+        for name, event_types, func in self._handlers:
+            cursor = cursors.get(name)
+            if cursor is None:
+                cursor = Cursor(handler=name, position=0, attempts=0, updated_at=now)
+                db.session.add(cursor)
+            if self._ready(cursor.position, cursor.retry_at, high, now):
+                ready.append((name, event_types, func, cursor))
+        if not ready:
+            db.session.rollback()
+            return 0, False
+
+        start = min(cursor.position for _, _, _, cursor in ready)
+        events = Event.query.filter(Event.id > start, Event.id <= high).order_by(Event.id).limit(batch_size).all()
+        if not events:
+            db.session.rollback()
+            return 0, False
+        # With nothing left below ``high``, skip ahead over the ids of rolled back events too
+        end = events[-1].id if len(events) == batch_size else high
+
+        more = len(events) == batch_size
+        for name, event_types, func, cursor in ready:
+            pending = [e for e in events if e.id > cursor.position and e.type in event_types]
+            failed, error = self._run_handler(func, pending)
+            if failed is None:
+                cursor.position = max(cursor.position, end)
+                cursor.attempts, cursor.retry_at, cursor.last_error = 0, None, None
+            elif self._record_failure(name, cursor, failed, error, now):
+                # Dead-lettered; the events after it can go right away
+                more = True
+            cursor.updated_at = now
+        db.session.commit()
+        return len(events), more
+
+    def _begin(self):
+        if self.db.engine.dialect.name == 'sqlite':
+            # Hold the write lock so dispatchers in other workers wait instead of failing; without
+            # an outer transaction the first RELEASE SAVEPOINT would also commit on its own
+            self.db.session.execute(self.db.text('BEGIN IMMEDIATE'))
+
+    def _run_handler(self, func, events):
+        """Apply ``events`` in savepoints; returns (first event that failed, its error) or (None, None)."""
+        session = self.db.session
+        if not events:
+            return None, None
+        savepoint = session.begin_nested()
+        try:
+            func(events)
+            savepoint.commit()
+            return None, None
+        except Exception as e:
+            savepoint.rollback()
+            if len(events) == 1:
+                return events[0], e
+        # Find the event that fails, keeping the ones before it
+        for row in events:
+            savepoint = session.begin_nested()
+            try:
+                func([row])
+                savepoint.commit()
+            except Exception as e:
+                savepoint.rollback()
+                return row, e
+        return None, None
+
+    def _record_failure(self, name, cursor, failed, error, now):
+        """Count a failure of ``failed``; returns True once it has been moved to the dead letters."""
+        if failed.id - 1 > cursor.position:
+            # A different event is failing now; it starts with a clean slate
+            cursor.position, cursor.attempts = failed.id - 1, 0
+        cursor.attempts += 1
+        cursor.last_error = repr(error)[:1000]
+        self.app.logger.warning('Outbox handler %s failed on event %d (attempt %d): %r',
+                                name, failed.id, cursor.attempts, error)
+        if cursor.attempts < self.app.config['OUTBOX_MAX_ATTEMPTS']:
+            delay = self.app.config['OUTBOX_RETRY_SECONDS'] * 2 ** (cursor.attempts - 1)
+            cursor.retry_at = now + timedelta(seconds=delay)
+            return False
+        self.db.session.add(self.dead_letter_model(
+            handler=name, event_id=failed.id, type=failed.type, payload=failed.payload,
+            created_at=failed.created_at, error=cursor.last_error, attempts=cursor.attempts, failed_at=now))
+        self.app.logger.error('Outbox event %d moved to the dead letters of %s', failed.id, name)
+        cursor.position, cursor.attempts, cursor.retry_at = failed.id, 0, None
+        return True
+
+    def replay(self, handler=None):
+        """Run dead letters through their handlers again; returns (replayed, still failing).
+
+        A dead letter has the ``type``, ``data`` and ``created_at`` of its
+        event, so it is passed to the handler in the event's place.
+        """
+        DeadLetter = self.dead_letter_model
+        handlers = {name: func for name, _, func in self._handlers}
+        query = DeadLetter.query.filter(DeadLetter.handler.in_(handlers)).order_by(DeadLetter.event_id)
+        if handler is not None:
+            query = query.filter(DeadLetter.handler == handler)
+        replayed = failed = 0
+        self._begin()
+        for letter in query.all():
+            savepoint = self.db.session.begin_nested()
+            try:
+                handlers[letter.handler]([letter])
+                self.db.session.delete(letter)
+                savepoint.commit()
+                replayed += 1
+            except Exception:
+                savepoint.rollback()
+                self.app.logger.exception('Replaying outbox event %d through %s failed', letter.event_id,
+                                          letter.handler)
+                failed += 1
+        self.db.session.commit()
+        return replayed, failed
+
+    def _positions(self):
+        positions = dict(self.db.session.query(self.cursor_model.handler, self.cursor_model.position))
+        return {name: (event_types, positions.get(name, 0)) for name, event_types, _ in self._handlers}
+
+    def pending(self):
+        """Undelivered events per handler."""
+        Event = self.event_model
+        return {name: self.db.session.query(self.db.func.count(Event.id))
+                .filter(Event.id > position, Event.type.in_(event_types)).scalar()
+                for name, (event_types, position) in self._positions().items()}
+
+    def lag(self):
+        """Age in seconds of the oldest event each handler has not processed yet."""
+        Event = self.event_model
+        now = datetime.utcnow()
+        lag = {}
+        for name, (event_types, position) in self._positions().items():
+            oldest = self.db.session.query(Event.created_at) \
+                .filter(Event.id > position, Event.type.in_(event_types)).order_by(Event.id).limit(1).scalar()
+            lag[name] = round((now - oldest).total_seconds(), 3) if oldest else 0
+        return lag
+
+    def dead_letters(self):
+        """Dead letters per handler."""
+        DeadLetter = self.dead_letter_model
+        counts = dict(self.db.session.query(DeadLetter.handler, self.db.func.count(DeadLetter.id))
+                      .group_by(DeadLetter.handler))
+        return {name: counts.get(name, 0) for name, _, _ in self._handlers}
+
+    def purge(self):
+        """Delete events every handler has processed once they are older than OUTBOX_RETENTION_HOURS."""
+        Event = self.event_model
+        positions = self._positions()
+        if not positions:
+            return 0
+        done = min(position for _, position in positions.values())
+        cutoff = datetime.utcnow() - timedelta(hours=self.app.config['OUTBOX_RETENTION_HOURS'])
+        deleted = Event.query.filter(Event.id <= done, Event.created_at < cutoff).delete(synchronize_session=False)
+        self.db.session.commit()
+        return deleted
@@ -0,0 +1,101 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from time import perf_counter
+
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+def normalize_method(method):
+    """Spell out the implicit PBKDF2 iteration count so stored and configured methods compare equal."""
+    parts = method.split(':')
+    if parts[0] == 'pbkdf2' and len(parts) == 2:
+        parts.append(str(DEFAULT_PBKDF2_ITERATIONS))
+    return ':'.join(parts)
+
+
+def calibrate(target_seconds, hash_name='sha256', password='calibration-password', rounds=3):
+    """Return the PBKDF2 method whose hash takes about ``target_seconds`` on this machine."""
+    iterations = 50000
+    while True:
+        method = f'pbkdf2:{hash_name}:{iterations}'
+        elapsed = min(timed_hash(method, password) for _ in range(rounds))
+        if elapsed >= target_seconds * 0.9:
+            return method, elapsed
+        # Scale linearly towards the target, rounded to a readable multiple
+        estimate = int(iterations * target_seconds / max(elapsed, 1e-6))
+        iterations = max(iterations + 10000, round(estimate, -4))
+
+
+def timed_hash(method, password):
+    start = perf_counter()
+    generate_password_hash(password, method=method)
+    return perf_counter() - start
+
+
+class PasswordHasher:
+    """Runs password hashing on a small bounded thread pool.
+
+    PBKDF2 releases the GIL, so a pool sized to the CPU count keeps hashing
+    off the request threads without oversubscribing the machine. When more
+    than ``PASSWORD_HASH_MAX_PENDING`` operations are queued or running, new
+    ones are refused with 503 instead of piling up behind a login storm; so
+    is one still waiting after ``PASSWORD_HASH_TIMEOUT`` seconds.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._executor = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+        app.config.setdefault('PASSWORD_HASH_MAX_PENDING', 32)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 10)
+        self.app = app
+        self._executor = ThreadPoolExecutor(max_workers=app.config['PASSWORD_HASH_WORKERS'],
+                                            thread_name_prefix='password-hash')
+
+    @property
+    def method(self):
+        return normalize_method(self.app.config['PASSWORD_HASH_METHOD'])
+
+    @property
+    def pending(self):
+        """Operations queued or running on the pool."""
+        return self._pending
+
+    def _run(self, func, *args):
+        with self._lock:
+            if self._pending >= self.app.config['PASSWORD_HASH_MAX_PENDING']:
+                raise ServiceUnavailable(retry_after=1)
+            self._pending += 1
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._done()
+            raise
+        future.add_done_callback(lambda _: self._done())
+        try:
+            return future.result(timeout=self.app.config['PASSWORD_HASH_TIMEOUT'])
+        except FutureTimeout:
+            # Drop it from the queue if no worker has picked it up yet
+            future.cancel()
+            raise ServiceUnavailable(retry_after=1)
+
+    def _done(self):
+        with self._lock:
+            self._pending -= 1
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True when a stored hash was made with other parameters than the configured method."""
+        return normalize_method(password_hash.split('$', 1)[0]) != self.method
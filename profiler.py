@@ -0,0 +1,233 @@
+import json
+import os
+import sys
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime
+from time import perf_counter
+
+from flask import abort, g, has_app_context, jsonify, request, send_from_directory
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def frame_name(code):
+    """``function (path:line)`` with the path relative to the sys.path entry it was imported from."""
+    filename = code.co_filename
+    for root in sorted((p for p in sys.path if p), key=len, reverse=True):
+        if filename.startswith(root + os.sep):
+            filename = filename[len(root) + 1:]
+            break
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ':')
+
+
+class RequestProfile:
+    """Stack samples and SQL timings of one profiled request.
+
+    A sampler thread reads the request thread's frame from
+    ``sys._current_frames()`` every interval, so the request itself only
+    pays for the SQL hooks. A sample taken while a statement is running
+    gets the statement as its leaf frame.
+    """
+
+    def __init__(self, thread_id, interval, max_seconds, max_queries, sampled):
+        self.id = uuid.uuid4().hex[:12]
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.max_queries = max_queries
+        self.sampled = sampled
+        self.stacks = Counter()
+        self.queries = []
+        self.query_count = 0
+        self.db_time = 0.0
+        self.current_sql = None
+        self.start = perf_counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        deadline = self.start + self.max_seconds
+        while not self._stop.wait(self.interval) and perf_counter() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            sql = self.current_sql
+            if sql is not None:
+                stack.append('SQL ' + ' '.join(sql.split())[:120].replace(';', ':'))
+            self.stacks[';'.join(stack)] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return perf_counter() - self.start
+
+    def collapsed(self):
+        """The samples in the collapsed-stack format read by flamegraph.pl and speedscope."""
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.stacks.items()))
+
+
+class Profiler:
+    """On-demand sampling profiler for individual requests.
+
+    An admin (as decided by ``is_admin``) profiles a request by sending the
+    ``X-Profile`` header or a ``_profile`` query argument. With
+    ``PROFILER_SAMPLE_RATE`` set to N, one in every N requests of each
+    endpoint is also profiled, and at most ``PROFILER_MAX_ACTIVE`` sampled
+    requests run under the profiler at once so the overhead stays bounded.
+
+    Each profile is saved in ``PROFILER_DIR`` as a ``.folded`` file of
+    collapsed stacks and a ``.json`` file with the request details and SQL
+    timings; the newest ``PROFILER_KEEP`` pairs are kept. Admins list and
+    download them under ``/_profiles``.
+    """
+
+    def __init__(self, app=None, is_admin=None):
+        self._lock = threading.Lock()
+        self._seen = Counter()
+        self._active = None
+        if app is not None:
+            self.init_app(app, is_admin)
+
+    def init_app(self, app, is_admin):
+        app.config.setdefault('PROFILER_DIR', os.path.join(app.instance_path, 'profiles'))
+        app.config.setdefault('PROFILER_INTERVAL_MS', 5)
+        app.config.setdefault('PROFILER_MAX_SECONDS', 60)
+        app.config.setdefault('PROFILER_MAX_QUERIES', 1000)
+        app.config.setdefault('PROFILER_SAMPLE_RATE', 0)
+        app.config.setdefault('PROFILER_MAX_ACTIVE', 1)
+        app.config.setdefault('PROFILER_KEEP', 200)
+        self.app = app
+        self.is_admin = is_admin
+        self.directory = app.config['PROFILER_DIR']
+        self._active = threading.BoundedSemaphore(app.config['PROFILER_MAX_ACTIVE'])
+
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule('/_profiles', 'profiles', self.index)
+        app.add_url_rule('/_profiles/<path:filename>', 'profile_file', self.download)
+
+    def _requested(self):
+        if not (request.headers.get('X-Profile') or '_profile' in request.args):
+            return False
+        return bool(self.is_admin())
+
+    def _sample_this(self):
+        """Count the request against its endpoint and pick every Nth one."""
+        rate = self.app.config['PROFILER_SAMPLE_RATE']
+        if not rate or request.endpoint in (None, 'static', 'metrics', 'profiles', 'profile_file'):
+            return False
+        with self._lock:
+            self._seen[request.endpoint] += 1
+            return self._seen[request.endpoint] % rate == 0
+
+    def _before_request(self):
+        sampled = False
+        if not self._requested():
+            if not self._sample_this() or not self._active.acquire(blocking=False):
+                return
+            sampled = True
+        config = self.app.config
+        g.profile = RequestProfile(threading.get_ident(), config['PROFILER_INTERVAL_MS'] / 1000.0,
+                                   config['PROFILER_MAX_SECONDS'], config['PROFILER_MAX_QUERIES'], sampled)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        profile = g.get('profile') if has_app_context() else None
+        if profile is not None and profile.thread_id == threading.get_ident():
+            profile.current_sql = statement
+            conn.info.setdefault('profile_query_start', []).append(perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        profile = g.get('profile') if has_app_context() else None
+        if profile is None or profile.thread_id != threading.get_ident() or not conn.info.get('profile_query_start'):
+            return
+        elapsed = perf_counter() - conn.info['profile_query_start'].pop()
+        profile.current_sql = None
+        profile.query_count += 1
+        profile.db_time += elapsed
+        if len(profile.queries) < profile.max_queries:
+            profile.queries.append({'statement': statement, 'duration_ms': round(elapsed * 1000, 3)})
+
+    def _after_request(self, response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        try:
+            total = profile.stop()
+            name = self._save(profile, total, response.status_code)
+        finally:
+            if profile.sampled:
+                self._active.release()
+        if not profile.sampled:
+            response.headers['X-Profile'] = f'{request.script_root}/_profiles/{name}.folded'
+        return response
+
+    def _teardown_request(self, exc):
+        # The request failed before after_request; stop sampling without saving
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile.stop()
+            if profile.sampled:
+                self._active.release()
+
+    def _save(self, profile, total, status):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{request.endpoint or 'unknown'}-{profile.id}"
+        with open(os.path.join(self.directory, name + '.folded'), 'w', encoding='utf-8') as f:
+            f.write(profile.collapsed())
+        with open(os.path.join(self.directory, name + '.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'id': profile.id,
+                'endpoint': request.endpoint,
+                'method': request.method,
+                'path': request.full_path.rstrip('?'),
+                'status': status,
+                'sampled': profile.sampled,
+                'duration_ms': round(total * 1000, 3),
+                'interval_ms': profile.interval * 1000,
+                'samples': sum(profile.stacks.values()),
+                'query_count': profile.query_count,
+                'db_ms': round(profile.db_time * 1000, 3),
+                'queries': profile.queries
+            }, f, ensure_ascii=False, indent=1)
+        self.app.logger.info('Profiled %s %s in %.1f ms: %s', request.method, request.path, total * 1000, name)
+        self._prune()
+        return name
+
+    def _prune(self):
+        names = sorted(f[:-len('.json')] for f in os.listdir(self.directory) if f.endswith('.json'))
+        for name in names[:-self.app.config['PROFILER_KEEP']]:
+            for suffix in ('.folded', '.json'):
+                try:
+                    os.remove(os.path.join(self.directory, name + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def index(self):
+        """Saved profiles, newest first."""
+        if not self.is_admin():
+            abort(404)
+        if not os.path.isdir(self.directory):
+            return jsonify({'profiles': []})
+        names = sorted((f[:-len('.json')] for f in os.listdir(self.directory) if f.endswith('.json')), reverse=True)
+        return jsonify({'profiles': [{
+            'name': name,
+            'folded': f'{request.script_root}/_profiles/{name}.folded',
+            'details': f'{request.script_root}/_profiles/{name}.json'
+        } for name in names]})
+
+    def download(self, filename):
+        if not self.is_admin():
+            abort(404)
+        return send_from_directory(self.directory, filename, as_attachment=filename.endswith('.folded'),
+                                   mimetype='text/plain' if filename.endswith('.folded') else None)
@@ -0,0 +1,112 @@
+"""Per-route SQL query budgets that catch N+1 regressions.
+
+    python query_budget.py                 # seed a temporary dataset and check every budget
+    python query_budget.py --db bench.db   # check against an existing benchmark dataset
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from contextlib import contextmanager
+
+from app import app, db, User, check_achievements
+from instrumentation import capture_queries
+import benchmark
+
+# Maximum statements per request for a logged-in user, including the user load
+QUERY_BUDGETS = {
+    'stats': 5,
+    'view_program': 2,
+    'goals': 2,
+    'programs': 2,
+    'exercises': 2,
+    'calendar': 2,
+    'check_achievements': 3,
+}
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a block runs more SQL statements than its budget."""
+
+    def __init__(self, label, budget, statements):
+        self.label = label
+        self.budget = budget
+        self.statements = statements
+        lines = [f'{label}: {len(statements)} queries, budget is {budget}']
+        for number, (statement, parameters) in enumerate(statements, start=1):
+            lines.append(f'  {number}. {" ".join(statement.split())}  {parameters!r}')
+        super().__init__('\n'.join(lines))
+
+
+@contextmanager
+def assert_max_queries(budget, label='block'):
+    """Fail with the offending SQL if the block executes more than ``budget`` statements."""
+    with capture_queries() as capture:
+        yield capture
+    if len(capture) > budget:
+        raise QueryBudgetExceeded(label, budget, capture.statements)
+
+
+def route_url(name, program_id):
+    if name == 'view_program':
+        return f'/view_program/{program_id}'
+    return f'/{name}'
+
+
+def check_budgets(budgets=None):
+    """Run every budgeted route against the configured database and return the failures."""
+    budgets = budgets or QUERY_BUDGETS
+    failures = []
+    with app.app_context():
+        user_id = benchmark.pick_subjects(random.Random(0), 1)[0]
+        program_id = db.session.query(db.func.min(benchmark.WorkoutProgram.id)).scalar()
+        client = app.test_client()
+
+        for name, budget in budgets.items():
+            try:
+                if name == 'check_achievements':
+                    with app.test_request_context():
+                        user = User.query.get(user_id)
+                        # Awarding inserts rows once; the budget covers the steady state
+                        check_achievements(user)
+                        db.session.refresh(user)
+                        with assert_max_queries(budget, name):
+                            check_achievements(user)
+                else:
+                    benchmark.login(client, user_id)
+                    with assert_max_queries(budget, name):
+                        response = client.get(route_url(name, program_id))
+                    if response.status_code >= 500:
+                        raise AssertionError(f'{name}: HTTP {response.status_code}')
+                print(f'ok    {name:20} {budget:3}')
+            except AssertionError as e:
+                print(f'FAIL  {e}')
+                failures.append(name)
+            finally:
+                db.session.remove()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', help='Existing dataset; a small one is generated when omitted.')
+    args = parser.parse_args(argv)
+
+    path = args.db
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        benchmark.generate(argparse.Namespace(db=path, users=50, programs=200, workouts=20000, goals=500,
+                                              history_days=365, seed=1))
+    benchmark.use_database(path)
+    try:
+        failures = check_budgets()
+    finally:
+        if args.db is None:
+            os.remove(path)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import math
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import request
+from werkzeug.exceptions import TooManyRequests
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_limit(text):
+    """Parse ``'10/minute'`` into (capacity, tokens refilled per second)."""
+    count, _, period = text.partition('/')
+    capacity = int(count)
+    return capacity, capacity / PERIODS[period.strip().rstrip('s')]
+
+
+class RateLimiter:
+    """Per-route token buckets kept in a SQLite file shared by every worker process.
+
+    Limits come from ``RATELIMIT_LIMITS``: a mapping of limit name to
+    ``{scope: 'N/period'}``. The ``ip`` scope keys buckets by client address
+    and ``user`` by the ``identity`` callback; routes can add their own
+    scopes. A request is rejected with 429 and ``Retry-After`` as soon as one
+    of its buckets is empty.
+    """
+
+    def __init__(self, app=None, identity=None):
+        self._local = threading.local()
+        self.identity = identity
+        self.path = None
+        self.logger = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        app.config.setdefault('RATELIMIT_STORAGE', 'ratelimit.db')
+        app.config.setdefault('RATELIMIT_LIMITS', {})
+        self.app = app
+        self.logger = app.logger
+        self.path = app.config['RATELIMIT_STORAGE']
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS bucket (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    full_at REAL NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            self._local.connection = connection
+        return connection
+
+    def hit(self, key, capacity, rate, cost=1):
+        """Take ``cost`` tokens from a bucket; return 0 if allowed, else seconds until it would be."""
+        now = time.time()
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+            retry_after = 0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                retry_after = (cost - tokens) / rate
+            connection.execute('INSERT OR REPLACE INTO bucket (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)',
+                               (key, tokens, now, now + (capacity - tokens) / rate))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return retry_after
+
+    def check(self, name, scopes):
+        """Apply every configured bucket of limit ``name``; return the longest wait, 0 if allowed."""
+        limits = self.app.config['RATELIMIT_LIMITS'].get(name, {})
+        retry_after = 0
+        for scope, text in limits.items():
+            value = scopes[scope]() if scope in scopes else None
+            if value is None:
+                continue
+            capacity, rate = parse_limit(text)
+            retry_after = max(retry_after, self.hit(f'{name}:{scope}:{value}', capacity, rate))
+        return retry_after
+
+    def limit(self, name, methods=('POST',), **scopes):
+        """Decorate a view with the buckets configured under ``name``.
+
+        Extra keyword arguments are scope callbacks, e.g.
+        ``username=lambda: request.form.get('username')``.
+        """
+        scopes.setdefault('ip', lambda: request.remote_addr)
+        if self.identity is not None:
+            scopes.setdefault('user', self.identity)
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.app.config['RATELIMIT_ENABLED'] and request.method in methods:
+                    try:
+                        retry_after = self.check(name, scopes)
+                    except sqlite3.Error:
+                        # Fail open: a busy or broken store must not take the site down
+                        self.logger.exception('Rate limit store unavailable')
+                        retry_after = 0
+                    if retry_after:
+                        raise TooManyRequests(retry_after=math.ceil(retry_after))
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def purge(self):
+        """Delete buckets that have refilled; they behave exactly like missing ones."""
+        connection = self._connection()
+        return connection.execute('DELETE FROM bucket WHERE full_at <= ?', (time.time(),)).rowcount
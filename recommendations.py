@@ -0,0 +1,105 @@
+"""Content-based program similarity computed in batch with NumPy."""
+import math
+from collections import Counter
+
+import numpy as np
+
+
+def split_list(value):
+    """Split a comma-separated model field into normalized tokens."""
+    if not value:
+        return []
+    return [item.strip().lower() for item in value.split(',') if item.strip()]
+
+
+def program_tokens(program_type, difficulty, fitness_level, muscle_groups, equipment, exercise_names):
+    """Return the weighted feature tokens describing one program."""
+    tokens = {}
+    for field, value in (('type', program_type), ('difficulty', difficulty), ('level', fitness_level)):
+        if value:
+            tokens[f'{field}:{value.strip().lower()}'] = 1.0
+    for muscle in split_list(muscle_groups):
+        tokens[f'muscle:{muscle}'] = 1.0
+    for item in split_list(equipment):
+        tokens[f'equipment:{item}'] = 0.5
+    for name in exercise_names:
+        tokens[f'exercise:{name.strip().lower()}'] = 0.5
+    return tokens
+
+
+class FeatureSpace:
+    """Vocabulary of the most frequent tokens with IDF weights."""
+
+    def __init__(self, max_features=512):
+        self.max_features = max_features
+        self.columns = {}
+        self.idf = None
+
+    def fit(self, documents):
+        document_frequency = Counter(token for tokens in documents for token in tokens)
+        vocabulary = [token for token, _ in document_frequency.most_common(self.max_features)]
+        self.columns = {token: column for column, token in enumerate(vocabulary)}
+        count = len(documents)
+        self.idf = np.array([math.log((1 + count) / (1 + document_frequency[token])) + 1 for token in vocabulary],
+                            dtype=np.float32)
+        return self
+
+    def transform(self, documents):
+        """Build an L2-normalized (documents x features) float32 matrix."""
+        matrix = np.zeros((len(documents), len(self.columns)), dtype=np.float32)
+        for row, tokens in enumerate(documents):
+            for token, weight in tokens.items():
+                column = self.columns.get(token)
+                if column is not None:
+                    matrix[row, column] = weight
+        matrix *= self.idf
+        return normalize_rows(matrix)
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def weighted_sum_rows(matrix, rows, source_rows, weights, chunk_size=100000):
+    """Sum ``weights * matrix[source_rows]`` into ``rows`` of a new (max(rows) + 1) x features matrix."""
+    result = np.zeros((int(rows.max()) + 1 if len(rows) else 0, matrix.shape[1]), dtype=np.float32)
+    for start in range(0, len(rows), chunk_size):
+        end = start + chunk_size
+        np.add.at(result, rows[start:end], matrix[source_rows[start:end]] * weights[start:end, None])
+    return result
+
+
+def top_k(queries, targets, k, chunk_size=256, exclude=None):
+    """Yield (query row, target indices, scores) with the ``k`` best cosine matches per query.
+
+    Rows must be L2-normalized, so the dot product is the cosine similarity.
+    Queries are scored in chunks to bound memory at ``chunk_size x len(targets)``;
+    ``exclude`` is a pair of (query row, target column) arrays that are never
+    returned, e.g. the program itself or programs a user already completed.
+    Matches with a score of zero or less are dropped.
+    """
+    if len(targets) == 0 or k <= 0:
+        return
+    k = min(k, len(targets))
+    if exclude is not None:
+        order = np.argsort(exclude[0], kind='stable')
+        exclude_rows, exclude_columns = exclude[0][order], exclude[1][order]
+
+    for start in range(0, len(queries), chunk_size):
+        end = min(start + chunk_size, len(queries))
+        scores = queries[start:end] @ targets.T
+        if exclude is not None:
+            lo, hi = np.searchsorted(exclude_rows, [start, end])
+            scores[exclude_rows[lo:hi] - start, exclude_columns[lo:hi]] = -np.inf
+
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+
+        for offset in range(end - start):
+            keep = best_scores[offset] > 0
+            yield start + offset, best[offset][keep], best_scores[offset][keep]
@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import time
+from contextlib import closing
+from functools import wraps
+
+from flask import g, has_app_context, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
+
+
+class RoutingSession(SignallingSession):
+    """Session that reads from the replica while the request allows it.
+
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary,
+    and once the session has written every later statement follows them, so
+    a request never reads older data than it wrote.
+    """
+
+    def __init__(self, db, **options):
+        super().__init__(db, **options)
+        self.wrote = False
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.wrote = True
+        elif not self.wrote and has_app_context() and g.get('read_replica') is not None:
+            return g.read_replica.engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy whose sessions route reads through :class:`ReadReplica`."""
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class ReadReplica:
+    """Read replica engine for the routes marked with :meth:`reads`.
+
+    ``READ_REPLICA_URI`` names the replica; without it every query uses the
+    primary. A user who wrote within ``READ_REPLICA_STICKY_SECONDS`` keeps
+    reading from the primary for that long. When both databases are SQLite
+    files the replica is a copy that :meth:`refresh` rebuilds with the backup
+    API, which is how the split runs locally. The copy's age is its file's
+    modification time, so refreshes by any worker count, and once it is older
+    than ``READ_REPLICA_MAX_LAG_SECONDS`` every read goes to the primary
+    until the next refresh. Other replicas report no lag and are not bounded.
+    """
+
+    def __init__(self, app=None, db=None):
+        self.db = None
+        self.engine = None
+        self.sticky_seconds = 0
+        self.max_lag_seconds = 0
+        self.refreshed_at = None
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('READ_REPLICA_URI', None)
+        app.config.setdefault('READ_REPLICA_STICKY_SECONDS', 30)
+        app.config.setdefault('READ_REPLICA_REFRESH_SECONDS', 10)
+        app.config.setdefault('READ_REPLICA_MAX_LAG_SECONDS', 30)
+        self.db = db
+        self.sticky_seconds = app.config['READ_REPLICA_STICKY_SECONDS']
+        self.max_lag_seconds = app.config['READ_REPLICA_MAX_LAG_SECONDS']
+        if app.config['READ_REPLICA_URI']:
+            url, options = db.apply_driver_hacks(app, make_url(app.config['READ_REPLICA_URI']), {})
+            self.engine = create_engine(url, **options)
+        app.extensions['read_replica'] = self
+        app.after_request(self._after_request)
+
+    @property
+    def refreshable(self):
+        """Whether the replica is a local SQLite copy of a SQLite primary."""
+        return (self.engine is not None and self.engine.dialect.name == 'sqlite'
+                and self.db.engine.dialect.name == 'sqlite')
+
+    def available(self):
+        """Whether this request may read from the replica."""
+        if self.engine is None:
+            return False
+        now = time.time()
+        if self.refreshable:
+            # Another worker may run the refresh job, so the file tells when the copy was last rebuilt
+            self.refreshed_at = self._file_refreshed_at()
+            if self.refreshed_at is None or now - self.refreshed_at > self.max_lag_seconds:
+                return False
+        return now - session.get('_last_write', 0) >= self.sticky_seconds
+
+    def _file_refreshed_at(self):
+        """Modification time of the replica copy, including its WAL file; None if there is no copy."""
+        path = self.engine.url.database
+        try:
+            refreshed_at = os.path.getmtime(path)
+        except OSError:
+            return None
+        try:
+            return max(refreshed_at, os.path.getmtime(path + '-wal'))
+        except OSError:
+            return refreshed_at
+
+    def reads(self, view):
+        """Decorator sending the view's reads to the replica when it is fresh enough for the user."""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if self.available():
+                g.read_replica = self
+            return view(*args, **kwargs)
+        return wrapper
+
+    def _after_request(self, response):
+        if self.engine is not None and self.db.session().wrote:
+            session['_last_write'] = time.time()
+        return response
+
+    def refresh(self):
+        """Copy the primary SQLite database over the replica file."""
+        if not self.refreshable:
+            return
+        with closing(sqlite3.connect(self.db.engine.url.database)) as source, \
+                closing(sqlite3.connect(self.engine.url.database, timeout=30.0)) as target:
+            source.backup(target)
+        self.refreshed_at = time.time()
@@ -0,0 +1,121 @@
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask import session as current_session
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from werkzeug.datastructures import CallbackDict
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session data kept on the server; the cookie only carries ``sid``."""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.previous_sid = None  # Stored row to delete after regenerate()
+
+
+class SqliteSessionInterface(SessionInterface):
+    """Stores sessions in a SQLite file shared by every worker on the host.
+
+    The cookie holds an opaque random id, so it stays a few dozen bytes no
+    matter what the session contains and nothing in it can be decoded by
+    the client. Rows expire after ``permanent_session_lifetime``; ``sweep``
+    deletes the expired ones. Call :meth:`regenerate` whenever the user
+    behind the session changes so an id planted before login is worthless.
+    """
+
+    session_class = ServerSideSession
+
+    def __init__(self, app=None):
+        self._local = threading.local()
+        self.path = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SESSION_STORAGE', 'sessions.db')
+        self.path = app.config['SESSION_STORAGE']
+        app.session_interface = self
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS session (
+                    sid TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    expires REAL NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_session_expires ON session (expires)')
+            self._local.connection = connection
+        return connection
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            row = self._connection().execute(
+                'SELECT data FROM session WHERE sid = ? AND expires > ?', (sid, time.time())).fetchone()
+            if row is not None:
+                return self.session_class(session_json_serializer.loads(row[0]), sid=sid)
+        return self.session_class(sid=secrets.token_urlsafe(32), new=True)
+
+    def regenerate(self, session=None):
+        """Move the current session's data to a new id; the old row is deleted when the response is saved."""
+        session = current_session if session is None else session
+        if not session.new and session.previous_sid is None:
+            session.previous_sid = session.sid
+        session.sid = secrets.token_urlsafe(32)
+        session.modified = True
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.previous_sid is not None:
+            self._connection().execute('DELETE FROM session WHERE sid = ?', (session.previous_sid,))
+            session.previous_sid = None
+
+        if not session:
+            if session.modified:
+                if not session.new:
+                    self._connection().execute('DELETE FROM session WHERE sid = ?', (session.sid,))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        if session.modified or session.new:
+            self._connection().execute(
+                'INSERT OR REPLACE INTO session (sid, data, expires) VALUES (?, ?, ?)',
+                (session.sid, session_json_serializer.dumps(dict(session)), time.time() + lifetime))
+        elif self.should_set_cookie(app, session):
+            # Sliding expiry without rewriting the data
+            self._connection().execute('UPDATE session SET expires = ? WHERE sid = ?',
+                                       (time.time() + lifetime, session.sid))
+        else:
+            return
+
+        response.set_cookie(
+            name, session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+    def sweep(self):
+        """Delete expired sessions; returns how many were removed."""
+        return self._connection().execute('DELETE FROM session WHERE expires <= ?', (time.time(),)).rowcount